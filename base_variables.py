@@ -1,94 +1,101 @@
 import os
 import pandas as pd
-
-def add_sitecode_column(base_path, save_path):
-    reference_file = os.path.join(base_path, 'Kind-of-participant.csv')
-    if not os.path.exists(reference_file):
-        print("❌ Reference file 'Kind-of-participant.csv' not found.")
-        return
-
-    try:
-        reference_df = pd.read_csv(reference_file, sep=';', encoding='utf-8')
-    except Exception as e:
-        print(f"❌ Failed to read reference file: {e}")
-        return
-
+import run_report
+from parallel import map_files
+from io_utils import (append_csv, check_chunked_format, list_csv_files, read_table, read_table_chunks, stored_bytes,
+                      write_table)
+from dtype_utils import convert_integer_floats, to_small_int
+
+VISIT_MAP = {
+    0: [
+        "Screening", "Enrolment (patient)", "Enrolment (patient) CSRI", "Enrolment (Clinician)",
+        "Baseline", "Baseline (patient)", "ESM Baseline",
+        "Baseline (team lead)", "Baseline (finance staff)", "Baseline (clinician)"
+    ],
+    1: [
+        "T1 (2 months)", "T1 (patient) CSRI", "T1 (2 months) (patient)",
+        "ESM T1", "T1 (2 months) (clinician)", "T1 (2month) (2nd clinician)"
+    ],
+    2: [
+        "T2 (6 months)", "T2 (patient) CSRI", "T2 (6 months) (patient)",
+        "ESM T2", "T2 (6 months) (clinician)", "T2 (6month) (2nd clinician)"
+    ],
+    3: [
+        "T3 (12 months)", "T3 (patient) CSRI", "T3 (12 months) (patient)",
+        "ESM T3", "T3 (12 months) (clinician)", "T3 (12month) (2nd clinician)"
+    ]
+}
+VALUE_TO_CODE = {v: code for code, values in VISIT_MAP.items() for v in values}
+
+
+def build_site_map(reference_df):
+    """
+    Returns the participant_identifier -> Site mapping of 'Kind-of-participant.csv',
+    or None if the reference is missing the required columns.
+    """
     if 'participant_identifier' not in reference_df.columns or 'Site' not in reference_df.columns:
         print("❌ Reference file missing required columns.")
         print(f"Available columns: {reference_df.columns.tolist()}")
-        return
+        return None
 
-    reference_map = reference_df.set_index('participant_identifier')['Site'].to_dict()
-    log_entries = []
-    missing_records = []
-
-    if not os.path.exists(save_path):
-        os.makedirs(save_path)
+    return reference_df.set_index('participant_identifier')['Site'].to_dict()
 
-    excluded_files = {'study-participant-forms.csv', "participants.csv", "study-queries.csv"}
-    csv_files = [f for f in os.listdir(base_path) if f.endswith(".csv") and f not in excluded_files]
 
-    if not csv_files:
-        print(f"❌️ No CSV files found in base path: {os.path.abspath(base_path)}")
-        return
+def load_site_map(base_path, input_format='csv'):
+    """
+    Reads 'Kind-of-participant.csv' (in input_format) from base_path and returns its site mapping (None on failure).
+    """
+    if 'Kind-of-participant.csv' not in list_csv_files(base_path, input_format=input_format):
+        print("❌ Reference file 'Kind-of-participant.csv' not found.")
+        return None
 
-    for file_name in csv_files:
-        file_path = os.path.join(base_path, file_name)
-        # print(f">>> Processing file: {file_name}")
-        try:
-            df = pd.read_csv(file_path, sep=';', encoding='utf-8')
-        except Exception as e:
-            print(f"❌ Failed to read {file_name}: {e}")
-            continue
+    try:
+        reference_df = read_table(base_path, 'Kind-of-participant.csv', input_format, encoding='utf-8')
+    except Exception as e:
+        print(f"❌ Failed to read reference file: {e}")
+        return None
 
-        if 'participant_identifier' not in df.columns:
-            print(f"❌ Skipped {file_name}: No 'participant_identifier' column.")
-            continue
+    return build_site_map(reference_df)
 
-        site_codes = []
-        not_found = []
 
-        for pid in df['participant_identifier']:
-            if pid in reference_map:
-                site_codes.append(reference_map[pid])
-            else:
-                site_codes.append(None)
-                not_found.append(pid)
+def add_sitecode_to_df(df, reference_map):
+    """
+    Adds 'SiteCode' (smallest nullable integer dtype) right after 'participant_identifier'.
 
-        for pid in not_found:
-            missing_records.append((file_name, pid))
+    Returns:
+        df (pd.DataFrame): DataFrame with SiteCode.
+        not_found (pd.Series): participant_identifiers without a site, in row order.
+    """
+    pids = df['participant_identifier']
+    if 'SiteCode' in df.columns:
+        df = df.drop(columns='SiteCode')
+    df.insert(df.columns.get_loc('participant_identifier') + 1, 'SiteCode', to_small_int(pids.map(reference_map)))
+    not_found = pids[~pids.isin(reference_map.keys())]
 
-        df['SiteCode'] = pd.Series(site_codes, dtype="Int64")
+    return df, not_found
 
-        if 'participant_identifier' in df.columns and 'SiteCode' in df.columns:
-            cols = df.columns.tolist()
-            pid_index = cols.index("participant_identifier")
-            cols.insert(pid_index + 1, cols.pop(cols.index("SiteCode")))
-            df = df[cols]
 
-        # Convert float columns to Int64 only if all values are integer-like
-        for col in df.columns:
-            if pd.api.types.is_float_dtype(df[col]):
-                if df[col].dropna().apply(float.is_integer).all():
-                    df[col] = df[col].astype('Int64')
+def _sitecode_log_entries(file_name, n_rows, not_found):
+    log_entries = []
+    success_count = n_rows - len(not_found)
+    fail_count = len(not_found)
+    log_entries.append(f"{file_name} - SiteCode added: {success_count}, Missing: {fail_count}")
 
-        output_path = os.path.join(save_path, file_name)
-        try:
-            df.to_csv(output_path, index=False, encoding='utf-8', sep=';')
-            # print(f"✅ Saved updated file to: {os.path.abspath(output_path)}")
-        except Exception as e:
-            print(f"❌ Failed to save {file_name}: {e}")
-            continue
+    if fail_count:
+        unmatched = sorted(not_found.unique().tolist())
+        log_entries.append(f"{file_name} - Unmatched participant_identifiers: {unmatched}")
+        print(f"❗ {file_name} - Missing participant_identifiers ({fail_count}): {unmatched}")
+    return log_entries
 
-        success_count = len(df) - len(not_found)
-        fail_count = len(not_found)
-        log_entries.append(f"{file_name} - SiteCode added: {success_count}, Missing: {fail_count}")
 
-        if not_found:
-            log_entries.append(f"{file_name} - Unmatched participant_identifiers: {sorted(set(not_found))}")
-            print(f"❗ {file_name} - Missing participant_identifiers ({len(not_found)}): {sorted(set(not_found))}")
+def _missing_lines(file_name, values):
+    """
+    Formats unmatched values of one file as '<file_name>: <value>' lines, one per row.
+    """
+    return ''.join(f"{file_name}: " + values.astype(str) + "\n")
 
 
+def _save_sitecode_logs(log_entries, missing_records, save_path):
     if log_entries:
         log_file_path = os.path.join(save_path, '_sitecode_log.txt')
         with open(log_file_path, 'w', encoding='utf-8') as log_file:
@@ -100,91 +107,95 @@ def add_sitecode_column(base_path, save_path):
         missing_log_path = os.path.join(save_path, '_sitecode_missing.txt')
         with open(missing_log_path, 'w', encoding='utf-8') as f:
             f.write("file_name: participant_identifier\n")
-            for file_name, pid in missing_records:
-                f.write(f"{file_name}: {pid}\n")
+            for file_name, pids in missing_records:
+                f.write(_missing_lines(file_name, pids))
         print(f"✅⚠️ Missing SiteCodes saved to: {os.path.abspath(missing_log_path)}")
 
-    print(f"--- ✅✅✅ SiteCode processing completed! All outputs have been saved to: {save_path} ------------")
 
-def add_visitcode_column(base_path, save_path):
-    visit_map = {
-        0: [
-            "Screening", "Enrolment (patient)", "Enrolment (patient) CSRI", "Enrolment (Clinician)",
-            "Baseline", "Baseline (patient)", "ESM Baseline",
-            "Baseline (team lead)", "Baseline (finance staff)", "Baseline (clinician)"
-        ],
-        1: [
-            "T1 (2 months)", "T1 (patient) CSRI", "T1 (2 months) (patient)",
-            "ESM T1", "T1 (2 months) (clinician)", "T1 (2month) (2nd clinician)"
-        ],
-        2: [
-            "T2 (6 months)", "T2 (patient) CSRI", "T2 (6 months) (patient)",
-            "ESM T2", "T2 (6 months) (clinician)", "T2 (6month) (2nd clinician)"
-        ],
-        3: [
-            "T3 (12 months)", "T3 (patient) CSRI", "T3 (12 months) (patient)",
-            "ESM T3", "T3 (12 months) (clinician)", "T3 (12month) (2nd clinician)"
-        ]
-    }
+def add_sitecode_column(base_path, save_path, input_format='csv', output_format='csv'):
+    reference_map = load_site_map(base_path, input_format)
+    if reference_map is None:
+        return
 
-    value_to_code = {v: code for code, values in visit_map.items() for v in values}
+    log_entries = []
+    missing_records = []
 
     if not os.path.exists(save_path):
         os.makedirs(save_path)
 
-    log_entries = []
-    missing_records = []
+    csv_files = list_csv_files(base_path, input_format=input_format)
 
-    # csv_files = [f for f in os.listdir(base_path) if f.endswith(".csv")]
-    excluded_files = {'study-participant-forms.csv', "participants.csv", "study-queries.csv"}
-    csv_files = [f for f in os.listdir(base_path) if f.endswith(".csv") and f not in excluded_files]
+    if not csv_files:
+        print(f"❌️ No CSV files found in base path: {os.path.abspath(base_path)}")
+        return
 
     for file_name in csv_files:
-        file_path = os.path.join(base_path, file_name)
-        # print(f">>> Processing file: {file_name}")
-        try:
-            df = pd.read_csv(file_path, sep=';', encoding='utf-8')
-        except Exception as e:
-            print(f"❌ Failed to read {file_name}: {e}")
-            continue
+        with run_report.file_entry('sitecode', file_name) as entry:
+            # print(f">>> Processing file: {file_name}")
+            try:
+                df = read_table(base_path, file_name, input_format, encoding='utf-8')
+            except Exception as e:
+                print(f"❌ Failed to read {file_name}: {e}")
+                continue
+            entry.update(rows_in=len(df), bytes_read=stored_bytes(base_path, file_name, input_format))
+
+            if 'participant_identifier' not in df.columns:
+                print(f"❌ Skipped {file_name}: No 'participant_identifier' column.")
+                continue
+
+            df, not_found = add_sitecode_to_df(df, reference_map)
+            df = convert_integer_floats(df)
+            run_report.count('sitecode', 'missing_sitecodes', len(not_found))
+
+            if len(not_found):
+                missing_records.append((file_name, not_found))
+
+            try:
+                write_table(df, save_path, file_name, output_format, encoding='utf-8')
+                # print(f"✅ Saved updated file to: {os.path.abspath(save_path)}")
+            except Exception as e:
+                print(f"❌ Failed to save {file_name}: {e}")
+                continue
+            entry.update(rows_out=len(df), bytes_written=stored_bytes(save_path, file_name, output_format))
+
+            log_entries.extend(_sitecode_log_entries(file_name, len(df), not_found))
+
+    _save_sitecode_logs(log_entries, missing_records, save_path)
 
-        if "visit_name" not in df.columns:
-            print(f"⚠️ Skipped {file_name}: No 'visit_name' column.")
-            continue
+    print(f"--- ✅✅✅ SiteCode processing completed! All outputs have been saved to: {save_path} ------------")
+
+
+def add_visitcode_to_df(df):
+    """
+    Adds 'VisitCode' (see VISIT_MAP, as Int8) right after 'participant_identifier'.
+
+    Returns:
+        df (pd.DataFrame): DataFrame with VisitCode.
+        missing_visits (pd.Series): visit_names without a code, in row order.
+    """
+    visits = df['visit_name']
+    visit_codes = to_small_int(visits.map(VALUE_TO_CODE))
+    missing_visits = visits[~visits.isin(VALUE_TO_CODE.keys())]
+
+    if 'VisitCode' in df.columns:
+        df = df.drop(columns='VisitCode')
+    if 'participant_identifier' in df.columns:
+        df.insert(df.columns.get_loc('participant_identifier') + 1, 'VisitCode', visit_codes)
+    else:
+        df['VisitCode'] = visit_codes
+
+    return df, missing_visits
 
-        visit_codes = []
-        for idx, val in df['visit_name'].items():
-            if val in value_to_code:
-                visit_codes.append(value_to_code[val])
-            else:
-                visit_codes.append(pd.NA)
-                missing_records.append((file_name, val))
-
-        df['VisitCode'] = pd.Series(visit_codes, dtype="Int64")
-
-        if 'participant_identifier' in df.columns and 'VisitCode' in df.columns:
-            cols = df.columns.tolist()
-            v_idx = cols.index('participant_identifier')
-            cols.insert(v_idx + 1, cols.pop(cols.index('VisitCode')))
-            df = df[cols]
-
-        success_count = df['VisitCode'].notna().sum()
-        fail_count = df['VisitCode'].isna().sum()
-        log_entries.append(f"{file_name} - VisitCode added: {success_count}, Missing: {fail_count}")
-
-        # Convert float columns to Int64 only if all values are integer-like
-        for col in df.columns:
-            if pd.api.types.is_float_dtype(df[col]):
-                if df[col].dropna().apply(float.is_integer).all():
-                    df[col] = df[col].astype('Int64')
-
-        output_path = os.path.join(save_path, file_name)
-        try:
-            df.to_csv(output_path, index=False, encoding='utf-8', sep=';')
-            # print(f"✅ Saved with VisitCode to: {os.path.abspath(output_path)}")
-        except Exception as e:
-            print(f"❌ Failed to save {file_name}: {e}")
 
+def _visitcode_counts(df):
+    return df['VisitCode'].notna().sum(), df['VisitCode'].isna().sum()
+
+
+def _visitcode_log_entry(file_name, success_count, fail_count):
+    return f"{file_name} - VisitCode added: {success_count}, Missing: {fail_count}"
+
+
+def _save_visitcode_logs(log_entries, missing_records, save_path):
     # Save Logfiles
     if log_entries:
         log_file_path = os.path.join(save_path, '_visitcode_log.txt')
@@ -204,10 +215,293 @@ def add_visitcode_column(base_path, save_path):
         missing_log_path = os.path.join(save_path, '_visitcode_missing.txt')
         with open(missing_log_path, 'w', encoding='utf-8') as f:
             f.write("file_name: visit_name\n")
-            for fname, visit in missing_records:
-                f.write(f"{fname}: {visit}\n")
+            for fname, visits in missing_records:
+                f.write(_missing_lines(fname, visits))
         print(f"✅⚠️ Missing VisitCodes saved to: {os.path.abspath(missing_log_path)}")
 
+
+def add_visitcode_column(base_path, save_path, input_format='csv', output_format='csv'):
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+
+    log_entries = []
+    missing_records = []
+
+    csv_files = list_csv_files(base_path, input_format=input_format)
+
+    for file_name in csv_files:
+        with run_report.file_entry('visitcode', file_name) as entry:
+            # print(f">>> Processing file: {file_name}")
+            try:
+                df = read_table(base_path, file_name, input_format, encoding='utf-8')
+            except Exception as e:
+                print(f"❌ Failed to read {file_name}: {e}")
+                continue
+            entry.update(rows_in=len(df), bytes_read=stored_bytes(base_path, file_name, input_format))
+
+            if "visit_name" not in df.columns:
+                print(f"⚠️ Skipped {file_name}: No 'visit_name' column.")
+                continue
+
+            df, missing_visits = add_visitcode_to_df(df)
+            run_report.count('visitcode', 'missing_visitcodes', len(missing_visits))
+            if len(missing_visits):
+                missing_records.append((file_name, missing_visits))
+            log_entries.append(_visitcode_log_entry(file_name, *_visitcode_counts(df)))
+            df = convert_integer_floats(df)
+
+            try:
+                write_table(df, save_path, file_name, output_format, encoding='utf-8')
+                # print(f"✅ Saved with VisitCode to: {os.path.abspath(save_path)}")
+            except Exception as e:
+                print(f"❌ Failed to save {file_name}: {e}")
+                continue
+            entry.update(rows_out=len(df), bytes_written=stored_bytes(save_path, file_name, output_format))
+
+    _save_visitcode_logs(log_entries, missing_records, save_path)
+
     print(f"--- ✅✅✅ VisitCode processing completed! All outputs have been saved to: {save_path} ------------")
 
 
+def add_base_variables_to_df(df, reference_map):
+    """
+    Adds all base variables (SiteCode, VisitCode) to one DataFrame in a single pass.
+
+    Returns:
+        df (pd.DataFrame): DataFrame with the base variables.
+        not_found (pd.Series): participant_identifiers without a site, in row order.
+        missing_visits (pd.Series or None): visit_names without a code, in row order;
+            None if the file has no 'visit_name' column.
+    """
+    df, not_found = add_sitecode_to_df(df, reference_map)
+
+    missing_visits = None
+    if "visit_name" in df.columns:
+        df, missing_visits = add_visitcode_to_df(df)
+
+    df = convert_integer_floats(df)
+    return df, not_found, missing_visits
+
+
+def _count_missing(not_found, missing_visits):
+    run_report.count('base_variables', 'missing_sitecodes', len(not_found))
+    if missing_visits is not None:
+        run_report.count('base_variables', 'missing_visitcodes', len(missing_visits))
+
+
+def _enrich_df(file_name, df, reference_map, on_result):
+    """
+    Enriches one DataFrame and hands it to on_result(file_name, df) (returns False if it could not be saved).
+
+    Returns:
+        result (dict): What the logs need ('file_name', 'n_rows', 'not_found', 'missing_visits',
+            'visit_counts', 'saved'), see save_base_variable_logs; None if the file was skipped.
+    """
+    with run_report.file_entry('base_variables', file_name) as entry:
+        entry['rows_in'] = len(df)
+        if 'participant_identifier' not in df.columns:
+            print(f"❌ Skipped {file_name}: No 'participant_identifier' column.")
+            return None
+
+        df, not_found, missing_visits = add_base_variables_to_df(df, reference_map)
+        _count_missing(not_found, missing_visits)
+        if missing_visits is None:
+            print(f"⚠️ Skipped {file_name}: No 'visit_name' column.")
+
+        result = {
+            'file_name': file_name, 'n_rows': len(df), 'not_found': not_found, 'missing_visits': missing_visits,
+            'visit_counts': None if missing_visits is None else _visitcode_counts(df),
+        }
+        result['saved'] = on_result(file_name, df) is not False
+        if result['saved']:
+            entry['rows_out'] = len(df)
+        return result
+
+
+def save_base_variable_logs(results, log_path):
+    """
+    Writes the SiteCode and VisitCode logs of the per-file results (see _enrich_df), in their order.
+    Files without 'visit_name' get no VisitCode log, files that could not be saved no SiteCode log.
+    The unmatched values may also be lists (results read back from a scheduler checkpoint).
+    """
+    sitecode_log, sitecode_missing = [], []
+    visitcode_log, visitcode_missing = [], []
+
+    for result in results:
+        if result is None:
+            continue
+        file_name, not_found, missing_visits = result['file_name'], pd.Series(result['not_found']), result['missing_visits']
+        if missing_visits is not None:
+            missing_visits = pd.Series(missing_visits)
+        if len(not_found):
+            sitecode_missing.append((file_name, not_found))
+        if missing_visits is not None:
+            if len(missing_visits):
+                visitcode_missing.append((file_name, missing_visits))
+            visitcode_log.append(_visitcode_log_entry(file_name, *result['visit_counts']))
+        if result['saved']:
+            sitecode_log.extend(_sitecode_log_entries(file_name, result['n_rows'], not_found))
+
+    _save_sitecode_logs(sitecode_log, sitecode_missing, log_path)
+    _save_visitcode_logs(visitcode_log, visitcode_missing, log_path)
+
+
+def _enrich_dfs(dfs, reference_map, log_path, on_result, file_results=None):
+    """
+    Shared loop of add_base_variables_to_dfs: enriches every DataFrame yielded by dfs,
+    hands it to on_result(file_name, df) and writes all logs.
+    on_result returns False if the file could not be saved.
+    With file_results (file name -> result, see _enrich_df), the results are added to it and
+    the logs cover all of its files in its order.
+    """
+    file_results = {} if file_results is None else file_results
+    for file_name, df in dfs:
+        file_results[file_name] = _enrich_df(file_name, df, reference_map, on_result)
+    save_base_variable_logs(file_results.values(), log_path)
+
+
+def _enrich_file(file_name, shared):
+    """
+    Reads, enriches and writes one file of add_base_variables (shared: see add_base_variables).
+    Runs in a worker process in a parallel run.
+    """
+    base_path, save_path, input_format, output_format = (
+        shared['base_path'], shared['save_path'], shared['input_format'], shared['output_format'])
+    with run_report.file_entry('base_variables', file_name) as entry:
+        try:
+            df = read_table(base_path, file_name, input_format, encoding='utf-8')
+        except Exception as e:
+            print(f"❌ Failed to read {file_name}: {e}")
+            return None
+        entry['bytes_read'] = stored_bytes(base_path, file_name, input_format)
+
+    def save_file(file_name, df):
+        try:
+            write_table(df, save_path, file_name, output_format, encoding='utf-8')
+        except Exception as e:
+            print(f"❌ Failed to save {file_name}: {e}")
+            return False
+        run_report.record('base_variables', file_name, bytes_written=stored_bytes(save_path, file_name, output_format))
+
+    return _enrich_df(file_name, df, shared['reference_map'], save_file)
+
+
+def _enrich_file_chunked(file_name, shared):
+    """
+    Chunked variant of _enrich_file: the file is read, enriched and appended to save_path
+    chunk by chunk, so only one chunk is in memory. Returns the same result for the logs.
+    Integer conversion (convert_integer_floats) is decided per chunk.
+    """
+    base_path, save_path, input_format = shared['base_path'], shared['save_path'], shared['input_format']
+    n_rows, not_found, missing_visits = 0, [], []
+    visit_success, visit_fail = 0, 0
+    try:
+        with run_report.file_entry('base_variables', file_name) as entry:
+            for chunk_number, chunk in enumerate(read_table_chunks(base_path, file_name, input_format, shared['chunksize'], encoding='utf-8')):
+                if 'participant_identifier' not in chunk.columns:
+                    break
+                chunk, chunk_not_found, chunk_missing_visits = add_base_variables_to_df(chunk, shared['reference_map'])
+                _count_missing(chunk_not_found, chunk_missing_visits)
+                append_csv(chunk, save_path, file_name, first=chunk_number == 0, encoding='utf-8')
+
+                n_rows += len(chunk)
+                not_found.append(chunk_not_found)
+                if chunk_missing_visits is not None:
+                    missing_visits.append(chunk_missing_visits)
+                    success_count, fail_count = _visitcode_counts(chunk)
+                    visit_success += success_count
+                    visit_fail += fail_count
+            entry.update(rows_in=n_rows, rows_out=n_rows, bytes_read=stored_bytes(base_path, file_name, input_format),
+                         bytes_written=stored_bytes(save_path, file_name))
+    except Exception as e:
+        print(f"❌ Failed to process {file_name}: {e}")
+        return None
+
+    if not not_found:
+        print(f"❌ Skipped {file_name}: No 'participant_identifier' column.")
+        return None
+
+    if not missing_visits:
+        print(f"⚠️ Skipped {file_name}: No 'visit_name' column.")
+    return {
+        'file_name': file_name, 'n_rows': n_rows, 'not_found': pd.concat(not_found),
+        'missing_visits': pd.concat(missing_visits) if missing_visits else None,
+        'visit_counts': (visit_success, visit_fail) if missing_visits else None, 'saved': True,
+    }
+
+
+def enrich_file(file_name, shared):
+    """
+    Adds the base variables to one file of add_base_variables and writes it (in chunks with
+    shared['chunksize']; shared: see add_base_variables). Returns the result for the logs, see _enrich_df.
+    """
+    if shared['chunksize']:
+        return _enrich_file_chunked(file_name, shared)
+    return _enrich_file(file_name, shared)
+
+
+def add_base_variables(base_path, save_path, input_format='csv', output_format='csv', chunksize=None, workers=None):
+    """
+    Adds SiteCode and VisitCode to all MaganaMed CSV files with one read and one write per file.
+    Produces the same outputs and logs as add_sitecode_column followed by add_visitcode_column.
+
+    Args:
+        base_path (str): Path to the MaganaMed export (folder or ZIP file).
+        save_path (str): Path to save updated CSVs and logs.
+        input_format (str): Format of the input files: 'csv', 'parquet' or 'feather'.
+        output_format (str or list): Format(s) of the output files, e.g. ['csv', 'parquet'].
+        chunksize (int, optional): Process the files in chunks of this many rows (CSV output only),
+            so memory use is bounded by the chunk size instead of the file size.
+        workers (int, optional): Process the files in a pool of this many processes (see parallel.map_files);
+            the outputs and logs are the same as in a serial run.
+    """
+    if chunksize:
+        check_chunked_format(output_format)
+
+    reference_map = load_site_map(base_path, input_format)
+    if reference_map is None:
+        return
+
+    os.makedirs(save_path, exist_ok=True)
+
+    csv_files = list_csv_files(base_path, input_format=input_format)
+    if not csv_files:
+        print(f"❌️ No CSV files found in base path: {os.path.abspath(base_path)}")
+        return
+
+    shared = {
+        'base_path': base_path, 'save_path': save_path, 'input_format': input_format,
+        'output_format': output_format, 'chunksize': chunksize, 'reference_map': reference_map,
+    }
+    results = map_files(enrich_file, csv_files, shared, workers)
+    save_base_variable_logs(results, save_path)
+
+    print(f"--- ✅✅✅ Base variable processing completed! All outputs have been saved to: {save_path} ------------")
+
+
+def add_base_variables_to_dfs(dfs, reference_map, log_path, file_results=None):
+    """
+    In-memory variant of add_base_variables. Files without 'participant_identifier'
+    are dropped, as add_base_variables does not write them either.
+
+    Args:
+        dfs (dict): File name -> DataFrame.
+        reference_map (dict): participant_identifier -> Site, see build_site_map.
+        log_path (str): Folder for the SiteCode and VisitCode logs.
+        file_results (dict, optional): File name -> result of the file for the logs (see _enrich_df),
+            e.g. of files processed in an earlier run (None for files without logs). The results of dfs
+            are added to it and the logs cover all of its files, in its order.
+
+    Returns:
+        dfs (dict): Updated DataFrames.
+    """
+    os.makedirs(log_path, exist_ok=True)
+    result = {}
+
+    def keep(file_name, df):
+        result[file_name] = df
+
+    _enrich_dfs(dfs.items(), reference_map, log_path, keep, file_results)
+
+    print(f"--- ✅✅✅ Base variable processing completed! Logs have been saved to: {log_path} ------------")
+    return result
@@ -0,0 +1,57 @@
+"""
+Compares the previous per-column float.is_integer loop with dtype_utils.convert_integer_floats
+on wide synthetic forms shaped like CTQ and Demographics.
+
+Run from the repository root:
+    python benchmarks/bench_convert_integer_floats.py [rows]
+"""
+import os
+import sys
+import timeit
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dtype_utils import convert_integer_floats
+
+
+def convert_integer_floats_loop(df):
+    # Previous implementation, copied in every stage
+    for col in df.columns:
+        if pd.api.types.is_float_dtype(df[col]):
+            if df[col].dropna().apply(float.is_integer).all():
+                df[col] = df[col].astype('Int64')
+    return df
+
+
+def make_form(n_rows, item_cols, n_text_cols=4, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {f"text_{i}": rng.choice(["a", "b", None], n_rows) for i in range(n_text_cols)}
+    for col in item_cols:
+        values = rng.integers(1, 6, n_rows).astype(float)
+        values[rng.random(n_rows) < 0.1] = np.nan
+        data[col] = values
+    # One genuinely non-integer column, which must stay float
+    data["score_mean"] = rng.random(n_rows) * 5
+    return pd.DataFrame(data)
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    forms = {
+        "CTQ": [f"{i}_CTQ" for i in range(1, 29)] + ["CTQ_00z"],
+        "Demographics": [f"DEMO_{i:02d}" for i in range(1, 81)],
+    }
+    for form, item_cols in forms.items():
+        df = make_form(n_rows, item_cols)
+        expected = convert_integer_floats_loop(df.copy())
+        assert convert_integer_floats(df.copy()).equals(expected)
+
+        t_loop = min(timeit.repeat(lambda: convert_integer_floats_loop(df.copy()), number=1, repeat=3))
+        t_vec = min(timeit.repeat(lambda: convert_integer_floats(df.copy()), number=1, repeat=3))
+        print(f"{form:<14} rows={n_rows:<8} cols={df.shape[1]:<4} loop={t_loop:.3f}s "
+              f"vectorized={t_vec:.3f}s speedup={t_loop / t_vec:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Times every stage of the file-based pipeline on a synthetic export (see synthetic_export.py) and records
+wall time, throughput (input rows and MB per second) and peak Python memory (tracemalloc) per stage.
+
+The results are saved as JSON (with the git commit and code version), so runs of different versions
+can be compared:
+    python benchmarks/bench_pipeline_stages.py --participants 5000 --output results.json
+    python benchmarks/bench_pipeline_stages.py --participants 5000 --compare results.json
+
+Run from the repository root. Stage output is suppressed.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_PATH)
+import base_variables
+import id_processing
+import measure_calculation_woCopy
+import merge_redcap_n_maganamed
+from io_utils import EXCLUDED_FILES
+from run_manifest import code_version
+from synthetic_export import generate_export
+
+
+def pipeline_stages(paths, work_path):
+    """
+    Returns the stages of the file-based pipeline (as run by main.py before the in-memory pipeline)
+    as (name, input folder, function) tuples.
+    """
+    base_var = os.path.join(work_path, 'baseVar')
+    cal_var = os.path.join(work_path, 'calVar')
+    id_processed = os.path.join(work_path, 'idProcessed')
+    redcap = os.path.join(work_path, 'redcap')
+    df_redcapInfos = pd.read_csv(paths['redcap'], sep=';')
+
+    def calculate():
+        measure_calculation_woCopy.calculate_and_save(base_var, cal_var)
+        measure_calculation_woCopy.copy_unprocessed_files(base_var, cal_var)
+
+    return [
+        ('add_sitecode_column', paths['export'],
+         lambda: base_variables.add_sitecode_column(paths['export'], base_var)),
+        ('add_visitcode_column', base_var, lambda: base_variables.add_visitcode_column(base_var, base_var)),
+        ('calculate_and_save', base_var, calculate),
+        ('run_id_processing_and_save', cal_var,
+         lambda: id_processing.run_id_processing_and_save(paths['reference'], cal_var, id_processed)),
+        ('merge_redcap_n_maganamed', id_processed,
+         lambda: merge_redcap_n_maganamed.merge_redcap_n_maganamed(df_redcapInfos, id_processed, redcap)),
+    ]
+
+
+def input_size(folder):
+    """
+    Returns the data rows and bytes of the CSV files in folder (logs and excluded export files left out).
+    """
+    rows, size = 0, 0
+    for name in os.listdir(folder):
+        if not name.endswith('.csv') or name.startswith('_') or name in EXCLUDED_FILES:
+            continue
+        path = os.path.join(folder, name)
+        size += os.path.getsize(path)
+        with open(path, 'rb') as f:
+            rows += sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b'')) - 1
+    return rows, size
+
+
+def run_stage(function, trace_memory=False):
+    """
+    Runs one stage with its output suppressed; returns (seconds, peak traced bytes or None).
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function()
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def benchmark(paths, work_path, repeat=3, trace_memory=True):
+    """
+    Runs the whole stage chain repeat times (timing the best run of every stage), then once more
+    under tracemalloc for the peak memory, which would otherwise slow down the timed runs.
+
+    Returns:
+        results (dict): Stage name -> {'seconds', 'rows', 'bytes', 'rows_per_second', 'mb_per_second', 'peak_mb'}.
+    """
+    stages = pipeline_stages(paths, work_path)
+    results = {}
+    for _ in range(repeat):
+        for name, input_folder, function in stages:
+            rows, size = input_size(input_folder)
+            seconds, _ = run_stage(function)
+            if name not in results or seconds < results[name]['seconds']:
+                results[name] = {'seconds': round(seconds, 4), 'rows': rows, 'bytes': size,
+                                 'rows_per_second': round(rows / seconds), 'mb_per_second': round(size / seconds / 1e6, 2)}
+
+    if trace_memory:
+        for name, _, function in stages:
+            results[name]['peak_mb'] = round(run_stage(function, trace_memory=True)[1] / 1e6, 1)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_PATH, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    """
+    Prints one line per stage; with baseline results (same format), adds the time ratio against them.
+    """
+    for name, stage in results.items():
+        line = (f"{name:<28} {stage['seconds']:>8.3f}s {stage['rows_per_second']:>10} rows/s "
+                f"{stage['mb_per_second']:>7.2f} MB/s peak={stage.get('peak_mb', float('nan')):>7.1f} MB")
+        if baseline and name in baseline['stages']:
+            line += f"  x{stage['seconds'] / baseline['stages'][name]['seconds']:.2f} vs {baseline.get('commit')}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage benchmark of the pipeline on a synthetic export.")
+    parser.add_argument('--participants', type=int, default=1000)
+    parser.add_argument('--visits', type=int, default=4)
+    parser.add_argument('--sites', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc run")
+    parser.add_argument('--data', help="folder for the synthetic export and outputs (default: temporary)")
+    parser.add_argument('--output', help="JSON file to save the results to")
+    parser.add_argument('--compare', help="JSON results of a previous run to compare with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_path:
+        data_path = args.data or tmp_path
+        paths = generate_export(data_path, args.participants, args.visits, args.sites, args.seed)
+        stages = benchmark(paths, os.path.join(data_path, 'outputs'), args.repeat, not args.no_memory)
+
+    report = {
+        'commit': git_commit(),
+        'code_version': code_version(REPO_PATH),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'scale': {'participants': args.participants, 'visits': args.visits, 'sites': args.sites,
+                  'seed': args.seed, 'export_rows': paths['rows']},
+        'environment': {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                        'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'stages': stages,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != report['scale']:
+            print(f"⚠️ Different scale than the compared run: {baseline.get('scale')}")
+    print_results(stages, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Results saved to: {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
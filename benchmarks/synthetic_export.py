@@ -0,0 +1,216 @@
+"""
+Generates a synthetic MaganaMed export at a configurable scale, so the pipeline can be benchmarked
+without patient data:
+
+- one form per entry of measure_calculation_woCopy.INSTRUMENT_SPECS (real file names and item columns),
+  plus an unscored form, the ESM diary (several 'diary_date' entries per visit) and the excluded export files
+- 'Kind-of-participant.csv' with the Site of (almost) every participant
+- the ID processing reference Excel file with delete, exchange and merge rows
+- 'redcap_with_allocation.csv' with the allocation of (almost) every participant
+
+Run from the repository root:
+    python benchmarks/synthetic_export.py <output folder> [--participants N] [--visits N] [--sites N] [--seed N]
+"""
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from id_processing import REFERENCE_FILE
+from io_utils import EXCLUDED_FILES
+from measure_calculation_woCopy import INSTRUMENT_SPECS
+
+# Visit names in study order (all of them have a VisitCode, see base_variables.VISIT_MAP)
+VISIT_NAMES = [
+    "Baseline", "T1 (2 months)", "T2 (6 months)", "T3 (12 months)",
+    "Screening", "Enrolment (patient)", "ESM Baseline", "ESM T1", "ESM T2", "ESM T3",
+]
+
+# Forms without item columns in INSTRUMENT_SPECS get these columns
+GENERIC_COLUMNS = {
+    'Goal-Attainment-Scale.csv': ['GAS_01', 'GAS_02', 'GAS_03'],
+    'Demographics-(Patients).csv': ['Age', 'Gender', 'Education', 'Employment'],
+    'Self-injurious-Behavior-(T0).csv': ['SITBI-T0_01'],
+}
+UNSCORED_FORMS = {'Unscored-Form.csv': ['Q1', 'Q2', 'Comment']}
+ESM_FORM = 'ESM-Diary.csv'
+ESM_COLUMNS = [f'ESM_{i:02d}' for i in range(1, 11)]
+
+REFERENCE_COLUMNS = [
+    'Current ID', 'Act1: \nDelete complete data?', 'Act2: \nKeep complete data?', 'Act3: \nExchange data?',
+    'Act4: \nMerge data?\n(1: merge v, 2: merge c)', '\nAct3: EXCHANGE\nwith which ID', '\nAct3: EXCHANGE\nof which visit',
+    '\nAct4: MERGE 0\nKeep data of this ID until..', '\nAct4: MERGE 0\nalso merge these visits',
+    '\nAct4: MERGE 1\nwith which ID', '\nAct4: MERGE 1\ndata of other ID from..', 'ultimate ID', 'Check',
+]
+
+
+def form_columns(spec):
+    """
+    Returns the answer columns of one INSTRUMENT_SPECS entry: items, sources of copies, flags and 'other'.
+    """
+    columns = list(spec.get('items', []))
+    columns += [col for col in spec.get('copies', {}).values() if col not in columns]
+    for flag_label in spec.get('flag_labels', []):
+        columns += list(flag_label['flags'])
+        if flag_label.get('other'):
+            columns.append(flag_label['other'])
+    return columns + [col for col in GENERIC_COLUMNS.get(spec['file_name'], []) if col not in columns]
+
+
+def participant_ids(n_participants, n_sites):
+    """
+    Returns the participant_identifiers and their site (1..n_sites).
+    """
+    sites = np.arange(n_participants) % n_sites + 1
+    return [f"I-S{site}-P-{i:05d}" for i, site in enumerate(sites)], sites
+
+
+def _answers(rng, columns, n_rows, missing_rate):
+    # Integer answers 1-5 (as float, missing values as NaN); flags 0/1 and free-text columns
+    data = {}
+    for col in columns:
+        if col.startswith('Psychotherapy') and 'other' not in col:
+            data[col] = rng.integers(0, 2, n_rows)
+        elif 'other' in col or col == 'Comment':
+            data[col] = np.where(rng.random(n_rows) < 0.2, 'free text; with separator', None)
+        else:
+            values = rng.integers(1, 6, n_rows).astype(float)
+            values[rng.random(n_rows) < missing_rate] = np.nan
+            data[col] = values
+    return data
+
+
+def make_form(rng, pids, sites, visits, columns, entries_per_visit=1, completion=0.9, missing_rate=0.05,
+              always_complete=None):
+    """
+    Builds one form: a row per participant, visit (completed with probability completion) and entry.
+    Participants in the boolean mask always_complete have all visits.
+    """
+    n_visits = len(visits)
+    completed = rng.random((len(pids), n_visits)) < completion
+    if always_complete is not None:
+        completed[always_complete] = True
+    pid_pos, visit_pos = np.nonzero(completed)
+    pid_pos, visit_pos = np.repeat(pid_pos, entries_per_visit), np.repeat(visit_pos, entries_per_visit)
+    entry = np.tile(np.arange(entries_per_visit), len(pid_pos) // entries_per_visit)
+    n_rows = len(pid_pos)
+
+    dates = pd.Timestamp("2024-01-01") + pd.to_timedelta(visit_pos * 60 + entry, unit="D")
+    data = {
+        'participant_identifier': np.asarray(pids, dtype=object)[pid_pos],
+        'center_name': np.char.add('Center ', sites[pid_pos].astype(str)),
+        'visit_name': np.asarray(visits, dtype=object)[visit_pos],
+        'created_at': dates.strftime("%Y-%m-%d %H:%M:%S"),
+        # Every export file has 'diary_date'; only diaries (several entries per visit) fill it
+        'diary_date': dates.strftime("%Y-%m-%d") if entries_per_visit > 1 else None,
+    }
+    data.update(_answers(rng, columns, n_rows, missing_rate))
+    return pd.DataFrame(data)
+
+
+def make_reference(rng, pids, visits, fraction=0.01):
+    """
+    Builds the ID processing reference table: about fraction of the participants each are deleted,
+    kept, have a visit exchanged or are merged (visit- and ID-based); every participant is used once.
+    Exchanged participants need the same rows per visit, see make_form(always_complete=...).
+    """
+    n_ops = max(1, int(len(pids) * fraction))
+    pool = iter(rng.permutation(len(pids)).tolist())
+    take = lambda: pids[next(pool)]
+    last_visits = ', '.join(visits[len(visits) // 2:])
+    first_visits = ', '.join(visits[:max(1, len(visits) // 2)])
+
+    rows = []
+    for _ in range(n_ops):
+        rows.append({'Current ID': take(), 'Act1: \nDelete complete data?': 1})
+        rows.append({'Current ID': take(), 'Act2: \nKeep complete data?': 1})
+        rows.append({'Current ID': take(), 'Act3: \nExchange data?': 1, '\nAct3: EXCHANGE\nwith which ID': take(),
+                     '\nAct3: EXCHANGE\nof which visit': visits[0]})
+        cid = take()
+        rows.append({'Current ID': cid, 'Act4: \nMerge data?\n(1: merge v, 2: merge c)': 1,
+                     '\nAct4: MERGE 1\nwith which ID': take(), '\nAct4: MERGE 1\ndata of other ID from..': last_visits,
+                     'ultimate ID': cid + "-F"})
+        cid = take()
+        rows.append({'Current ID': cid, 'Act4: \nMerge data?\n(1: merge v, 2: merge c)': 2,
+                     '\nAct4: MERGE 1\nwith which ID': take(), '\nAct4: MERGE 0\nKeep data of this ID until..': first_visits,
+                     'ultimate ID': cid})
+    return pd.DataFrame(rows, columns=REFERENCE_COLUMNS)
+
+
+def generate_export(output_path, n_participants=1000, n_visits=4, n_sites=4, seed=0, diary_entries=5):
+    """
+    Writes a synthetic export to output_path:
+    'export/' (the MaganaMed CSV files), 'reference/' (the ID processing Excel file)
+    and 'redcap_with_allocation.csv'.
+
+    Returns:
+        paths (dict): 'export', 'reference' and 'redcap' paths, and 'rows' (export rows without excluded files).
+    """
+    if not 1 <= n_visits <= len(VISIT_NAMES):
+        raise ValueError(f"n_visits must be between 1 and {len(VISIT_NAMES)}")
+    rng = np.random.default_rng(seed)
+    export_path = os.path.join(output_path, "export")
+    reference_path = os.path.join(output_path, "reference")
+    os.makedirs(export_path, exist_ok=True)
+    os.makedirs(reference_path, exist_ok=True)
+
+    pids, sites = participant_ids(n_participants, n_sites)
+    visits = VISIT_NAMES[:n_visits]
+
+    reference = make_reference(rng, pids, visits)
+    reference.to_excel(os.path.join(reference_path, REFERENCE_FILE), index=False)
+    exchanged = reference['Act3: \nExchange data?'].notna()
+    exchanged_ids = set(reference.loc[exchanged, 'Current ID']) | set(reference.loc[exchanged, '\nAct3: EXCHANGE\nwith which ID'])
+    always_complete = np.isin(pids, list(exchanged_ids))
+
+    forms = {spec['file_name']: form_columns(spec) for spec in INSTRUMENT_SPECS}
+    forms.update(UNSCORED_FORMS)
+    n_rows = 0
+    for file_name, columns in forms.items():
+        df = make_form(rng, pids, sites, visits, columns, always_complete=always_complete)
+        df.to_csv(os.path.join(export_path, file_name), sep=';', index=False)
+        n_rows += len(df)
+    esm = make_form(rng, pids, sites, visits, ESM_COLUMNS, entries_per_visit=diary_entries,
+                    always_complete=always_complete)
+    esm.to_csv(os.path.join(export_path, ESM_FORM), sep=';', index=False)
+    n_rows += len(esm)
+
+    # About 1% of the participants have no site (exchanged ones always have one, see make_form)
+    # and 3% no REDCap allocation
+    with_site = (rng.random(n_participants) > 0.01) | always_complete
+    kind = pd.DataFrame({
+        'participant_identifier': pids, 'center_name': np.char.add('Center ', sites.astype(str)),
+        'visit_name': visits[0], 'created_at': "2024-01-01 00:00:00", 'diary_date': None, 'Site': sites,
+    })[with_site]
+    kind.to_csv(os.path.join(export_path, 'Kind-of-participant.csv'), sep=';', index=False)
+    for file_name in EXCLUDED_FILES:
+        pd.DataFrame({'participant_identifier': pids[:10]}).to_csv(os.path.join(export_path, file_name), sep=';',
+                                                                  index=False)
+
+    allocated = rng.random(n_participants) > 0.03
+    redcap = pd.DataFrame({
+        'record_id': np.arange(n_participants), 'study_id': pids, 'unit': rng.integers(1, 9, n_participants),
+        'condition': rng.integers(1, 3, n_participants), 'randomize': rng.integers(0, 2, n_participants),
+    })[allocated]
+    redcap_path = os.path.join(output_path, 'redcap_with_allocation.csv')
+    redcap.to_csv(redcap_path, sep=';', index=False)
+
+    return {'export': export_path, 'reference': reference_path, 'redcap': redcap_path, 'rows': n_rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('output_path')
+    parser.add_argument('--participants', type=int, default=1000)
+    parser.add_argument('--visits', type=int, default=4)
+    parser.add_argument('--sites', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    paths = generate_export(args.output_path, args.participants, args.visits, args.sites, args.seed)
+    print(f"✅ Synthetic export with {paths['rows']} rows saved to: {os.path.abspath(args.output_path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+
+# Largest float that still fits into Int64
+_INT64_LIMIT = float(2 ** 63)
+
+# Low-cardinality text columns of the MaganaMed forms, held as categoricals (one code per row)
+CATEGORY_COLUMNS = ["participant_identifier", "visit_name", "center_name"]
+
+# Nullable integer dtypes, smallest first
+_NULLABLE_INT_DTYPES = ["Int8", "Int16", "Int32", "Int64"]
+
+
+def csv_dtypes(default=None):
+    """
+    Returns the dtype argument for pd.read_csv: CATEGORY_COLUMNS as categoricals,
+    all other columns as default (inferred by pandas if None).
+    """
+    categories = {col: "category" for col in CATEGORY_COLUMNS}
+    if default is None:
+        return categories
+    return defaultdict(lambda: default, categories)
+
+
+def compact_dtypes(df, columns=CATEGORY_COLUMNS):
+    """
+    Converts the given text columns of df (if present and not categorical yet) to categoricals.
+    """
+    for col in columns:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    return df
+
+
+def to_small_int(values):
+    """
+    Converts integer-like values (missing values allowed) to the smallest nullable integer
+    dtype that holds them (Int8 for codes). Raises TypeError for non-integer values, like astype('Int64').
+    """
+    values = pd.array(values, dtype="Int64")
+    if values.isna().all():
+        return values.astype("Int8")
+    low, high = values.min(), values.max()
+    for dtype in _NULLABLE_INT_DTYPES:
+        info = np.iinfo(dtype.lower())
+        if info.min <= low and high <= info.max:
+            return values.astype(dtype)
+
+
+def convert_integer_floats(df):
+    """
+    Converts float columns to Int64 only if all values are integer-like.
+
+    All float columns are checked at once on one 2-D NumPy block (one row per column)
+    and the Int64 arrays are built directly from that block, instead of calling
+    float.is_integer per value and astype per column.
+    """
+    float_cols = [col for col in df.columns if pd.api.types.is_float_dtype(df[col])]
+    if not float_cols:
+        return df
+
+    block = np.ascontiguousarray(df[float_cols].to_numpy(dtype='float64', na_value=np.nan).T)
+    nan_mask = np.isnan(block)
+    with np.errstate(invalid='ignore'):
+        integer_like = (np.abs(block) < _INT64_LIMIT) & (block == np.trunc(block))
+    convertible = (integer_like | nan_mask).all(axis=1)
+
+    if not convertible.any():
+        return df
+
+    values = np.where(nan_mask[convertible], 0, block[convertible]).astype('int64')
+    masks = nan_mask[convertible]
+    int_cols = [col for col, ok in zip(float_cols, convertible) if ok]
+    for i, col in enumerate(int_cols):
+        df[col] = pd.arrays.IntegerArray(values[i], masks[i])
+    return df
@@ -1,8 +1,29 @@
 import pandas as pd
+import numpy as np
 import os
+import pickle
+import run_report
+from io_utils import READ_WORKERS, copy_table, list_csv_files, output_formats, read_tables, stored_bytes, write_table
+from run_manifest import file_hash
 
-def load_reference_excel(refer_path):
-    ref_file = os.path.join(refer_path, "table_for_IDprocessing_allCentersVer6.xlsx")
+# Reference table with the ID processing rules, in the reference folder
+REFERENCE_FILE = "table_for_IDprocessing_allCentersVer6.xlsx"
+# Parsed reference table, next to the Excel file; bump the version when parse_reference_excel changes
+REFERENCE_CACHE_FILE = "_id_reference_cache.pkl"
+REFERENCE_CACHE_VERSION = 1
+# Columns read from files without IDs of the plan (enough for their logs, see iter_plan_csvs)
+ID_COLUMNS = ["participant_identifier", "visit_name"]
+
+
+def _split_visits(values):
+    # "V1, V2," -> ["V1", "V2"]
+    return [[i.strip() for i in x.split(",") if i.strip()] for x in values.fillna("")]
+
+
+def parse_reference_excel(ref_file):
+    """
+    Reads the reference Excel file and normalizes it: short column names, visit columns as lists.
+    """
     df_ref = pd.read_excel(ref_file)
 
     df_ref.rename(columns={
@@ -25,116 +46,808 @@ def load_reference_excel(refer_path):
         "current_id", "act1_delete", "act2_keep", "act3_exchange", "act4_merge", "act3_exchange_id", "act3_exchange_visit",
         "act4_merge_until", "act4_also_visit", "act4_merge_id", "act4_merge_visit", "final_id", "check"
     ]
-    df_ref = df_ref[expected_cols]
+    df_ref = df_ref[expected_cols].copy()
 
-    df_ref["act3_exchange_visit"] = df_ref["act3_exchange_visit"].fillna("").apply(lambda x: [i.strip() for i in x.split(",") if i.strip()])
-    df_ref["act4_merge_visit"] = df_ref["act4_merge_visit"].fillna("").apply(lambda x: [i.strip() for i in x.split(",") if i.strip()])
-    df_ref["act4_merge_until"] = df_ref["act4_merge_until"].fillna("").apply(lambda x: [i.strip() for i in x.split(",") if i.strip()])
-    df_ref["act4_also_visit"] = df_ref["act4_also_visit"].fillna("").apply(lambda x: [i.strip() for i in x.split(",") if i.strip()])
+    for col in ["act3_exchange_visit", "act4_merge_visit", "act4_merge_until", "act4_also_visit"]:
+        df_ref[col] = _split_visits(df_ref[col])
     # print("--- Loading xlsx file is complete. ---")
     return df_ref
 
 
+def load_reference_excel(refer_path, use_cache=True):
+    """
+    Loads the reference table (see parse_reference_excel) from refer_path.
 
-def load_all_csvs(base_path):
-    dfs = {}
-    excluded_files = {"participants.csv", "study-queries.csv", "study-participant-forms.csv"}
-    csv_files = [f for f in os.listdir(base_path) if f.endswith(".csv") and f not in excluded_files]
-    for file in csv_files:
-        path = os.path.join(base_path, file)
+    The parsed table is cached in refer_path/_id_reference_cache.pkl together with the mtime,
+    size and content hash of the Excel file. The cache is used while the mtime and size are
+    unchanged, or while the content hash is unchanged (e.g. after a copy); otherwise the Excel
+    file is parsed again and the cache is replaced.
+
+    Args:
+        refer_path (str): Folder with the reference Excel file.
+        use_cache (bool): Read and write the cache.
+
+    Returns:
+        df_ref (pd.DataFrame): Reference table.
+    """
+    ref_file = os.path.join(refer_path, REFERENCE_FILE)
+    if not use_cache:
+        return parse_reference_excel(ref_file)
+
+    cache_file = os.path.join(refer_path, REFERENCE_CACHE_FILE)
+    stat = os.stat(ref_file)
+    cached = None
+    if os.path.exists(cache_file):
         try:
-            df = pd.read_csv(path, sep=';', encoding='utf-8', on_bad_lines='skip', dtype='object')
-            dfs[file] = df
+            with open(cache_file, "rb") as f:
+                cached = pickle.load(f)
         except Exception as e:
-            print(f"❌ Error loading {file}: {e}")
+            print(f"⚠️ Ignoring unreadable reference cache {cache_file}: {e}")
+
+    if cached is not None and cached.get("version") == REFERENCE_CACHE_VERSION:
+        if (cached["mtime_ns"], cached["size"]) == (stat.st_mtime_ns, stat.st_size):
+            return cached["df_ref"]
+        content_hash = file_hash(ref_file)
+        if cached["hash"] == content_hash:
+            cached.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            _write_reference_cache(cached, cache_file)
+            return cached["df_ref"]
+    else:
+        content_hash = file_hash(ref_file)
+
+    df_ref = parse_reference_excel(ref_file)
+    _write_reference_cache({
+        "version": REFERENCE_CACHE_VERSION,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "hash": content_hash,
+        "df_ref": df_ref,
+    }, cache_file)
+    return df_ref
+
+
+def _write_reference_cache(cached, cache_file):
+    tmp_file = cache_file + ".tmp"
+    try:
+        with open(tmp_file, "wb") as f:
+            pickle.dump(cached, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print(f"⚠️ Could not write reference cache {cache_file}: {e}")
+
+
+
+def iter_csvs(base_path, input_format="csv", workers=READ_WORKERS, engine=None, file_names=None):
+    """
+    Yields (file name, DataFrame) for every file of base_path (or only file_names). The files are read in a pool of
+    workers threads (see io_utils.read_tables), at most workers files ahead of the one yielded;
+    with engine='pyarrow', CSV files are parsed by the pyarrow reader where it gives the same result.
+    Malformed lines are skipped (and counted in the run report).
+    """
+    csv_files = list_csv_files(base_path, input_format=input_format) if file_names is None else file_names
+    # CSVs are read as text; Parquet/Feather files keep their dtypes
+    tables = read_tables(base_path, csv_files, input_format, workers, engine, report_stage="id_processing",
+                         encoding='utf-8', on_bad_lines='skip', dtype='object')
+    for file, df in tables:
+        if isinstance(df, Exception):
+            print(f"❌ Error loading {file}: {df}")
+            continue
+        run_report.record("id_processing", file, bytes_read=stored_bytes(base_path, file, input_format))
+        yield file, df
+
+
+def load_all_csvs(base_path, input_format="csv", workers=READ_WORKERS, engine=None):
+    dfs = dict(iter_csvs(base_path, input_format, workers, engine))
     # print("--- Loading csv files is complete. ---")
     return dfs
 
-def apply_delete_operations(df_ref, dfs):
-    delete_log = []
 
-    for _, row in df_ref.iterrows():
-        cid = row["current_id"]
-        act1 = str(row["act1_delete"]).strip()
+def iter_plan_csvs(plan, base_path, workers=READ_WORKERS, engine=None, scans=None):
+    """
+    Yields (file name, DataFrame) for every CSV file of base_path, like iter_csvs, but only the files
+    containing an ID of the plan (see plan_ids) are read in full. All files are first scanned for their
+    ID_COLUMNS; a file without IDs of the plan is yielded as this scan, which is enough for its logs,
+    and apply_id_plan_to_df returns it as it is, so the file itself can be copied (see io_utils.copy_table;
+    malformed lines of such a file are then kept).
+    If scans is a dict, the scans yielded are also stored in it by file name.
+    """
+    ids = plan_ids(plan)
+    csv_files = list_csv_files(base_path)
+    id_reads = read_tables(base_path, csv_files, "csv", workers, report_stage="id_processing",
+                           encoding='utf-8', on_bad_lines='skip', dtype='object', usecols=lambda col: col in ID_COLUMNS)
+    id_columns = {}
+    touched = []
+    for file, df in id_reads:
+        run_report.record("id_processing", file, bytes_read=stored_bytes(base_path, file))
+        if isinstance(df, Exception) or _has_ids(df, ids):
+            touched.append(file)  # read (or reported as not readable) by iter_csvs
+        else:
+            id_columns[file] = df
+    print(f"🔎 {len(touched)} of {len(csv_files)} file(s) contain IDs of the reference table")
+
+    full_reads = iter_csvs(base_path, "csv", workers, engine, file_names=touched)
+    next_read = next(full_reads, None)
+    for file in csv_files:
+        if file in id_columns:
+            df = id_columns.pop(file)
+            if scans is not None:
+                scans[file] = df
+            yield file, df
+            del df
+        elif next_read is not None and next_read[0] == file:
+            yield next_read
+            next_read = next(full_reads, None)
+
+
+def build_id_index(df):
+    """
+    Groups the rows of one file by participant_identifier once (factorize + one stable argsort),
+    so that operations only touch the rows of the IDs they concern.
 
-        if "1" in act1:
-            for file, df in dfs.items():
-                if "participant_identifier" not in df.columns:
-                    continue
+    Returns:
+        index (dict): 'codes' (participant_identifier -> group number), 'order' and 'starts'
+            (row positions of group i are order[starts[i]:starts[i + 1]], ascending) and
+            'visits' (visit_name values, None if the file has no 'visit_name' column).
+    """
+    codes, uniques = pd.factorize(df["participant_identifier"], use_na_sentinel=True)
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    # Rows without ID (code -1) are sorted first and never looked up
+    starts = np.concatenate([[0], np.cumsum(counts)]) + np.count_nonzero(codes < 0)
+    return {
+        "codes": {pid: i for i, pid in enumerate(uniques)},
+        "order": order,
+        "starts": starts,
+        "visits": df["visit_name"].to_numpy() if "visit_name" in df.columns else None,
+    }
+
+
+def id_positions(index, pid, visits=None):
+    """
+    Returns the row positions of pid in the indexed file (only of the given visits, if any), ascending.
+    """
+    code = None if not isinstance(pid, str) and pd.isna(pid) else index["codes"].get(pid)
+    if code is None:
+        return np.array([], dtype=np.intp)
+    positions = index["order"][index["starts"][code]:index["starts"][code + 1]]
+    if visits is not None:
+        positions = positions[pd.Series(index["visits"][positions]).isin(visits).to_numpy()]
+    return positions
 
-                rows_to_delete = df[df["participant_identifier"] == cid]
-                visit_names = (
-                    rows_to_delete["visit_name"].unique().tolist()
-                    if "visit_name" in rows_to_delete.columns else ["unknown"]
-                )
-
-                # Log
-                for visit in visit_names:
-                    delete_log.append({
-                        "filename": file,
-                        "deleted_id": cid,
-                        "visit_name": visit
-                    })
-                # Apply deletion by keeping only rows that do NOT match the current ID
-                dfs[file] = df[df["participant_identifier"] != cid]
-            # print(f"--- Deleting process of {cid} is complete. ---")
 
-    return dfs, delete_log
+def id_visits(index, pid):
+    """
+    Returns the visits of pid in the indexed file, in order of their first row.
+    """
+    return pd.unique(index["visits"][id_positions(index, pid)]).tolist()
 
 
-def apply_exchange_operations(df_ref, dfs):
-    exchange_log = []
+def compile_id_plan(df_ref):
+    """
+    Compiles the reference table (see load_reference_excel) into an explicit operation plan.
+
+    Returns:
+        plan (dict):
+            'delete': IDs to delete, in reference order.
+            'exchange': list of {'current_id', 'target_id', 'visits'}, in reference order.
+            'exchange_map': (id, visit) -> ID whose data ends up there after all exchanges.
+            'merge': list of {'current_id', 'merge_id', 'final_id', 'merge_visits', 'until_visits'},
+                in reference order ('merge_visits' as in act4_merge_visit, 'until_visits' is
+                act4_merge_until + act4_also_visit, used if no merge visit exists in a file).
+            'merge_aliases': current/merge ID -> final_id.
+    """
+    plan = {"delete": [], "exchange": [], "exchange_map": {}, "merge": [], "merge_aliases": {}}
 
     for _, row in df_ref.iterrows():
         cid = row["current_id"]
-        act3 = str(row["act3_exchange"]).strip()
 
-        if "1" in act3:
+        if "1" in str(row["act1_delete"]).strip():
+            plan["delete"].append(cid)
+
+        if "1" in str(row["act3_exchange"]).strip():
             target_id = row["act3_exchange_id"]
-            target_visits = row["act3_exchange_visit"]
+            visits = [v.strip() for v in row["act3_exchange_visit"]]
+            plan["exchange"].append({"current_id": cid, "target_id": target_id, "visits": visits})
+            exchange_map = plan["exchange_map"]
+            for visit in visits:
+                source_cid = exchange_map.get((cid, visit), cid)
+                source_tid = exchange_map.get((target_id, visit), target_id)
+                exchange_map[(cid, visit)], exchange_map[(target_id, visit)] = source_tid, source_cid
+
+        act4 = str(row["act4_merge"]).strip()
+        if "1" in act4 or "2" in act4:
+            until_visits = []
+            if isinstance(row["act4_merge_until"], list):
+                until_visits.extend(row["act4_merge_until"])
+            if isinstance(row["act4_also_visit"], list):
+                until_visits.extend(row["act4_also_visit"])
+            plan["merge"].append({
+                "current_id": cid,
+                "merge_id": row["act4_merge_id"],
+                "final_id": row["final_id"],
+                "merge_visits": row["act4_merge_visit"],
+                "until_visits": [v.strip() for v in until_visits if v.strip()],
+            })
+            plan["merge_aliases"][cid] = row["final_id"]
+            plan["merge_aliases"][row["act4_merge_id"]] = row["final_id"]
+
+    plan["exchange_map"] = {key: source for key, source in plan["exchange_map"].items() if key[0] != source}
+    return plan
+
+
+def plan_ids(plan):
+    """
+    Returns the IDs whose rows the plan can change: deleted, exchanged and merged (current and merge) IDs.
+    A file without any of them is left as it is.
+    """
+    ids = set(plan["delete"])
+    for op in plan["exchange"]:
+        ids.update((op["current_id"], op["target_id"]))
+    for op in plan["merge"]:
+        ids.update((op["current_id"], op["merge_id"]))
+    return {pid for pid in ids if not _is_missing(pid)}
+
+
+def _has_ids(df, ids):
+    return "participant_identifier" in df.columns and bool(df["participant_identifier"].isin(ids).any())
+
+
+def describe_id_plan(plan):
+    """
+    Returns the plan as one row per operation, e.g. to save it or to compare two reference tables.
+    """
+    rows = []
+    for cid in plan["delete"]:
+        rows.append({"action": "delete", "id": cid})
+    for op in plan["exchange"]:
+        rows.append({"action": "exchange", "id": op["current_id"], "other_id": op["target_id"],
+                     "visits": ", ".join(op["visits"])})
+    for op in plan["merge"]:
+        merge_visits = op["merge_visits"] if isinstance(op["merge_visits"], list) else []
+        rows.append({"action": "merge", "id": op["current_id"], "other_id": op["merge_id"],
+                     "final_id": op["final_id"], "visits": ", ".join(merge_visits),
+                     "until_visits": ", ".join(op["until_visits"])})
+    for (pid, visit), source in plan["exchange_map"].items():
+        rows.append({"action": "exchange_result", "id": pid, "other_id": source, "visits": visit})
+
+    columns = ["action", "id", "other_id", "final_id", "visits", "until_visits"]
+    return pd.DataFrame(rows, columns=columns).fillna("").astype(str)
+
+
+def diff_id_plans(old_plan, new_plan):
+    """
+    Compares two plans (e.g. of two versions of the reference table).
+
+    Returns:
+        diff (pd.DataFrame): Operations only in one of the plans, 'change' being 'removed' or 'added'.
+    """
+    old_ops = describe_id_plan(old_plan)
+    new_ops = describe_id_plan(new_plan)
+    diff = old_ops.merge(new_ops, how="outer", indicator="change")
+    diff = diff[diff["change"] != "both"]
+    diff["change"] = diff["change"].map({"left_only": "removed", "right_only": "added"})
+    return diff.reset_index(drop=True)
+
+
+def save_id_plan(plan, save_path):
+    """
+    Saves the plan (see describe_id_plan) to save_path as _id_plan.csv.
+    """
+    os.makedirs(save_path, exist_ok=True)
+    describe_id_plan(plan).to_csv(os.path.join(save_path, "_id_plan.csv"), sep=';', index=False, encoding='utf-8-sig')
+
+
+def _is_missing(value):
+    return not isinstance(value, str) and pd.isna(value)
+
+
+def _new_id_state(df):
+    """
+    Mutable state of one file during ID processing. The DataFrame itself is never modified:
+    deletions, exchanges and relabels are recorded on arrays and applied once by _materialize.
+    """
+    n_rows = len(df)
+    return {
+        "df": df,
+        "index": build_id_index(df),
+        "groups": {},  # participant_identifier -> row positions, for IDs changed by relabels
+        "alive": np.ones(n_rows, dtype=bool),
+        "pids": None,  # current participant_identifier values, copied on the first relabel
+        "source": np.arange(n_rows),  # row holding the (exchanged) data of each row
+        "swapped": np.zeros(n_rows, dtype=bool),
+        "keys": np.arange(n_rows),  # output order (within an ID once the file is sorted)
+        "next_key": n_rows,
+        "sorted": False,
+        "visit_counts": None,
+        "values": None,  # object block of df, built for the first merge comparison
+    }
+
+
+def _rows(state, pid, visits=None):
+    """
+    Returns the positions of the remaining rows of pid (only of the given visits, if any), in output order.
+    """
+    if _is_missing(pid):
+        return np.array([], dtype=np.intp)
+    positions = state["groups"][pid] if pid in state["groups"] else id_positions(state["index"], pid)
+    positions = positions[state["alive"][positions]]
+    if visits is not None:
+        row_visits = state["index"]["visits"][positions]
+        selected = np.zeros(len(positions), dtype=bool)
+        for visit in visits:
+            selected |= row_visits == visit
+        positions = positions[selected]
+    return positions[np.argsort(state["keys"][positions], kind="stable")]
+
+
+def _group(state, pid):
+    return state["groups"][pid] if pid in state["groups"] else id_positions(state["index"], pid)
+
+
+def _relabel(state, positions, new_id):
+    if not len(positions):
+        return
+    if state["pids"] is None:
+        state["pids"] = state["df"]["participant_identifier"].to_numpy(dtype=object, copy=True)
+    pids = state["pids"]
+    for old_id in pd.unique(pids[positions]):
+        if not _is_missing(old_id):
+            state["groups"][old_id] = np.setdiff1d(_group(state, old_id), positions)
+    if not _is_missing(new_id):
+        state["groups"][new_id] = np.union1d(_group(state, new_id), positions)
+    pids[positions] = new_id
+
+
+def _drop(state, positions):
+    state["alive"][positions] = False
+    if state["visit_counts"] is not None:
+        for visit, count in pd.Series(state["index"]["visits"][positions]).value_counts(dropna=False).items():
+            state["visit_counts"][visit] -= count
+
+
+def _has_visit(state, visit):
+    if state["visit_counts"] is None:
+        visits = pd.Series(state["index"]["visits"][state["alive"]])
+        state["visit_counts"] = visits.value_counts(dropna=False).to_dict()
+    return state["visit_counts"].get(visit, 0) > 0
+
+
+def _current_ids(state, positions):
+    if state["pids"] is not None:
+        return state["pids"][positions]
+    return state["df"]["participant_identifier"].to_numpy(dtype=object)[positions]
+
+
+def _regroup_order(state, final_id, before_pos, before_ids, was_sorted, moved=()):
+    """
+    Sets the output order of the rows of final_id after a merge, as the previous per-merge sort did:
+    rows in their previous order (by previous ID first if the file was already sorted),
+    rows moved by the merge last.
+    """
+    if _is_missing(final_id):
+        members = before_pos[state["alive"][before_pos] & pd.isna(_current_ids(state, before_pos))]
+    else:
+        members = _rows(state, final_id)
+    if not len(members):
+        return
+    # Rows of final_id after a merge all had cid, mid or final_id before it
+    previous_ids = before_ids[np.searchsorted(before_pos, members)]
+    if was_sorted:
+        # Rank of the previous IDs as sort_values orders them (missing IDs last)
+        id_ranks, _ = pd.factorize(pd.Series(previous_ids, dtype=object), sort=True)
+        id_ranks[id_ranks < 0] = id_ranks.max(initial=0) + 1
+    else:
+        id_ranks = np.zeros(len(members), dtype=np.intp)
+    order = np.lexsort((state["keys"][members], id_ranks, np.isin(members, moved)))
+    state["keys"][members[order]] = np.arange(len(members))
+
+
+def _delete_ids(state, delete_ids):
+    log = []
+    deleted = set()
+    has_visits = state["index"]["visits"] is not None
+
+    for step, cid in enumerate(delete_ids):
+        positions = _rows(state, cid)
+        if not has_visits:
+            visit_names = ["unknown"]
+        else:
+            visit_names = pd.unique(state["index"]["visits"][positions]).tolist()
+
+        for visit in visit_names:
+            log.append((step, {"deleted_id": cid, "visit_name": visit}))
+        if cid not in deleted:
+            deleted.add(cid)
+            _drop(state, positions)
+    return log
+
+
+def _exchange_ids(state, exchanges):
+    log = []
+
+    for step, op in enumerate(exchanges):
+        cid, target_id = op["current_id"], op["target_id"]
+        for visit in op["visits"]:
+            # Rows of current ID and target ID at the given visit
+            cid_pos = _rows(state, cid, [visit])
+            tid_pos = _rows(state, target_id, [visit])
+            # Raise an error if the number of rows doesn't match
+            if len(cid_pos) != len(tid_pos):
+                raise ValueError(f"Row count mismatch between {cid} and {target_id} for visit {visit}")
+
+            if len(cid_pos):
+                # Swap the data positionally and move the exchanged rows to the end (current ID first)
+                source = state["source"]
+                source[cid_pos], source[tid_pos] = source[tid_pos], source[cid_pos]
+                state["swapped"][cid_pos] = state["swapped"][tid_pos] = True
+                next_key = state["next_key"]
+                state["keys"][cid_pos] = next_key + np.arange(len(cid_pos))
+                state["keys"][tid_pos] = next_key + len(cid_pos) + np.arange(len(tid_pos))
+                state["next_key"] = next_key + len(cid_pos) + len(tid_pos)
+
+            log.append((step, {
+                "exchanged_id_1": cid,
+                "exchanged_id_2": target_id,
+                "visit_name": visit,
+                "rows_exchanged_from_1": len(cid_pos),
+                "rows_exchanged_from_2": len(tid_pos)
+            }))
+    return log
+
+
+CONFLICT_COLUMNS = ["filename", "cid", "mid", "visit", "row", "column", "cid_value", "mid_value"]
+
+
+def _normalized_values(state, positions, columns):
+    """
+    Current values of the rows at positions as stripped strings ('' for missing values), rows x columns.
+    Exchanged columns come from the source rows.
+    """
+    df = state["df"]
+    if state["values"] is None:
+        state["values"] = df.to_numpy(dtype=object)
+    col_idx = df.columns.get_indexer(columns)
+    values = state["values"][state["source"][positions][:, None], col_idx]
+    for i, col in enumerate(columns):
+        if col == "participant_identifier":
+            values[:, i] = _current_ids(state, positions)
+        elif col in ("created_at", "visit_name"):
+            values[:, i] = state["values"][positions, col_idx[i]]
+    missing = pd.isna(values)
+    strings = np.char.strip(values.astype(str))
+    strings[missing] = ""
+    return strings
+
+
+def _rank_within(codes):
+    # Position of every element among the elements with the same code (0, 1, ...), in order
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    ranks = np.empty(len(codes), dtype=np.intp)
+    ranks[order] = np.arange(len(codes)) - np.searchsorted(sorted_codes, sorted_codes, side="left")
+    return ranks
+
+
+def compare_merge_rows(cid_values, mid_values, cid_visits, mid_visits):
+    """
+    Compares the rows of two IDs visit by visit, all visits at once: the n-th row of one ID
+    is compared with the n-th row of the other ID at the same visit.
 
-            for file, df in dfs.items():
-                if "participant_identifier" not in df.columns or "visit_name" not in df.columns:
+    Args:
+        cid_values, mid_values (np.ndarray): Normalized values (rows x columns), see _normalized_values.
+        cid_visits, mid_visits (np.ndarray): Visit of each row.
+
+    Returns:
+        decisions (dict): visit -> 'mid empty', 'same' or 'conflict' (visits with rows of both IDs).
+        differences (pd.DataFrame): 'visit', 'row' (pair number, from 1), 'column' (column number),
+            'cid_value', 'mid_value' of every differing value ('' for a missing row).
+    """
+    codes, visits = pd.factorize(np.concatenate([cid_visits, mid_visits]), use_na_sentinel=False)
+    cid_codes, mid_codes = codes[:len(cid_visits)], codes[len(cid_visits):]
+    cid_ranks, mid_ranks = _rank_within(cid_codes), _rank_within(mid_codes)
+    width = max(cid_ranks.max(initial=0), mid_ranks.max(initial=0)) + 1
+    cid_keys = cid_codes * width + cid_ranks
+    mid_keys = mid_codes * width + mid_ranks
+
+    # Align the rows of both IDs on (visit, row number); a missing row counts as all ''
+    pairs = np.union1d(cid_keys, mid_keys)
+    n_cols = cid_values.shape[1]
+    cid_aligned = np.full((len(pairs), n_cols), "", dtype=object)
+    mid_aligned = np.full((len(pairs), n_cols), "", dtype=object)
+    cid_aligned[np.searchsorted(pairs, cid_keys)] = cid_values
+    mid_aligned[np.searchsorted(pairs, mid_keys)] = mid_values
+    has_both = np.isin(pairs, cid_keys) & np.isin(pairs, mid_keys)
+    differs = cid_aligned != mid_aligned
+
+    pair_codes = pairs // width
+    mid_filled = np.bincount(mid_codes, weights=(mid_values != "").any(axis=1), minlength=len(visits))
+    unequal = np.bincount(pair_codes, weights=~has_both | differs.any(axis=1), minlength=len(visits))
+    decisions = {}
+    for code in np.intersect1d(cid_codes, mid_codes):
+        decisions[visits[code]] = "mid empty" if not mid_filled[code] else "same" if not unequal[code] else "conflict"
+
+    pair_nr, col_nr = np.nonzero(differs)
+    differences = pd.DataFrame({
+        "visit": np.asarray(visits, dtype=object)[pair_codes[pair_nr]],
+        "row": pairs[pair_nr] % width + 1,
+        "column": col_nr,
+        "cid_value": cid_aligned[pair_nr, col_nr],
+        "mid_value": mid_aligned[pair_nr, col_nr],
+    })
+    return decisions, differences
+
+
+def _merge_ids(state, merges):
+    log = []
+    conflicts = []
+    df = state["df"]
+
+    for step, op in enumerate(merges):
+        cid, mid, final_id = op["current_id"], op["merge_id"], op["final_id"]
+        visits_merge = op["merge_visits"]
+
+        cid_all = _rows(state, cid)
+        mid_all = _rows(state, mid)
+        affected = len(cid_all) > 0 or len(mid_all) > 0
+        was_sorted = state["sorted"]
+        # Merged files are sorted by participant_identifier (applied once in _materialize)
+        state["sorted"] = True
+
+        common_visits = (
+            [v for v in dict.fromkeys(visits_merge) if _has_visit(state, v)]
+            if isinstance(visits_merge, list) else []
+        )
+
+        if affected:
+            before_pos = np.unique(np.concatenate([cid_all, mid_all, _rows(state, final_id)]))
+            before_ids = _current_ids(state, before_pos).copy()
+
+        if common_visits:
+            # Merge based on act4_merge_visit:
+            # cid rows in the common visits are dropped, mid rows in the common visits move to final_id,
+            # all other mid rows are dropped and the remaining cid rows become final_id
+            cid_common = _rows(state, cid, common_visits)
+            mid_common = np.setdiff1d(_rows(state, mid, common_visits), cid_common)
+            rows_moved_count = len(mid_common)
+
+            if affected:
+                mid_dropped = np.setdiff1d(mid_all, np.concatenate([cid_common, mid_common]))
+                cid_rest = np.setdiff1d(cid_all, np.concatenate([cid_common, mid_all]))
+                _drop(state, np.concatenate([cid_common, mid_dropped]))
+                _relabel(state, cid_rest, final_id)
+                _relabel(state, mid_common, final_id)
+                _regroup_order(state, final_id, before_pos, before_ids, was_sorted, moved=mid_common)
+
+            log.append((step, {
+                "current_id": cid,
+                "merge_id": mid,
+                "final_id": final_id,
+                "visits_merged": visits_merge,
+                "common_visits": common_visits,
+                "rows_moved": rows_moved_count,
+                "note": "merged by act4_merge_visit"
+            }))
+
+        elif affected:
+            # Merge based on act4_merge_until + act4_also_visit (i.e., process all other visits)
+            # set no ending idx as csv-files have different amount of columns
+            data_cols = df.columns[df.columns.get_loc("diary_date") + 1:]
+
+            def add_log(visit, action):
+                log.append((step, {
+                    "visit": visit, "cid": cid, "mid": mid, "final_id": final_id, "action": action
+                }))
+
+            # Rows of both IDs only exist until the first visit that is not a conflict,
+            # so all comparisons can be made at once on the rows as they are now
+            cid_rows = _rows(state, cid, op["until_visits"])
+            mid_rows = _rows(state, mid, op["until_visits"])
+            visit_of = state["index"]["visits"]
+            decisions, differences = compare_merge_rows(
+                _normalized_values(state, cid_rows, data_cols), _normalized_values(state, mid_rows, data_cols),
+                visit_of[cid_rows], visit_of[mid_rows]
+            )
+
+            for visit in op["until_visits"]:
+                cid_pos = _rows(state, cid, [visit])
+                mid_pos = _rows(state, mid, [visit])
+
+                if not len(cid_pos) and not len(mid_pos):
                     continue
 
-                for visit in [v.strip() for v in target_visits]:
-                    # Create masks for current ID and target ID at the given visit
-                    cid_mask = (df["participant_identifier"] == cid) & (df["visit_name"] == visit)
-                    tid_mask = (df["participant_identifier"] == target_id) & (df["visit_name"] == visit)
-                    # Extract the original data for both IDs
-                    cid_rows = df[cid_mask].copy()
-                    tid_rows = df[tid_mask].copy()
-                    # (Optional) Swap participant_identifier (commented out)
-                    # cid_rows["participant_identifier"] = target_id
-                    # tid_rows["participant_identifier"] = cid
-                    # Raise an error if the number of rows doesn't match
-                    if len(cid_rows) != len(tid_rows):
-                        raise ValueError(f"Row count mismatch between {cid} and {target_id} for visit {visit}")
-
-                    # Define columns to swap (exclude ID, created_at, visit_name)
-                    columns_to_swap = [col for col in df.columns if
-                                       col not in ["participant_identifier", "created_at", "visit_name"]]
-                    # Swap values between the two sets of rows
-                    cid_rows[columns_to_swap], tid_rows[columns_to_swap] = (
-                        tid_rows[columns_to_swap].values,
-                        cid_rows[columns_to_swap].values
-                    )
-                    # Replace the original rows with the exchanged ones
-                    df = df[~cid_mask & ~tid_mask]
-                    df = pd.concat([df, cid_rows, tid_rows], ignore_index=True)
-                    dfs[file] = df
-
-                    # Save log info
-                    exchange_log.append({
-                        "filename": file,
-                        "exchanged_id_1": cid,
-                        "exchanged_id_2": target_id,
-                        "visit_name": visit,
-                        "rows_exchanged_from_1": len(cid_rows),
-                        "rows_exchanged_from_2": len(tid_rows)
-                    })
-            # print(f"--- Exchanging process btw {cid} and {target_id} is complete. ---")
+                if not len(cid_pos) and len(mid_pos):
+                    _relabel(state, mid_pos, cid)
+                    _relabel(state, _rows(state, cid), final_id)
+                    add_log(visit, "mid only → moved to cid (act4_until)")
+
+                elif len(cid_pos) and not len(mid_pos):
+                    _relabel(state, _rows(state, cid), final_id)
+                    add_log(visit, "cid only → kept (act4_until)")
+
+                elif decisions[visit] == "mid empty":
+                    _drop(state, mid_pos)
+                    _relabel(state, _rows(state, cid), final_id)
+                    add_log(visit, "mid empty → kept cid (act4_until)")
+
+                elif decisions[visit] == "same":
+                    _drop(state, mid_pos)
+                    _relabel(state, _rows(state, cid), final_id)
+                    add_log(visit, "both same → kept cid (act4_until)")
+
+                else:
+                    add_log(visit, "conflict → manual check needed")
+                    visit_differences = differences[differences["visit"] == visit]
+                    conflicts.append((step, visit_differences.assign(
+                        cid=cid, mid=mid, column=data_cols[visit_differences["column"].to_numpy()]
+                    )))
+
+            _regroup_order(state, final_id, before_pos, before_ids, was_sorted)
+    return log, conflicts
+
+
+def _materialize(state):
+    """
+    Builds the processed DataFrame with one take (plus one concat if data was exchanged).
+    Returns the input DataFrame itself if nothing changed.
+    """
+    df = state["df"]
+    positions = np.flatnonzero(state["alive"])
+    if state["sorted"]:
+        order_by = pd.DataFrame({"pid": _current_ids(state, positions), "key": state["keys"][positions]})
+        order = order_by.sort_values(["pid", "key"], kind="stable").index.to_numpy()
+    else:
+        order = np.argsort(state["keys"][positions], kind="stable")
+    positions = positions[order]
+
+    changed = state["pids"] is not None or state["swapped"].any()
+    if not changed and len(positions) == len(df) and (positions == np.arange(len(df))).all():
+        return df
+
+    if state["swapped"].any():
+        # Exchanged rows get the data of their source rows (all columns except ID, created_at and visit_name)
+        columns_to_swap = [col for col in df.columns if col not in ["participant_identifier", "created_at", "visit_name"]]
+        swapped_pos = np.flatnonzero(state["swapped"])
+        kept_pos = np.flatnonzero(~state["swapped"])
+        swapped_rows = df.iloc[swapped_pos].copy()
+        swapped_rows[columns_to_swap] = df.iloc[state["source"][swapped_pos]][columns_to_swap].values
+        out_position = np.empty(len(df), dtype=np.intp)
+        out_position[kept_pos] = np.arange(len(kept_pos))
+        out_position[swapped_pos] = len(kept_pos) + np.arange(len(swapped_pos))
+        out = pd.concat([df.iloc[kept_pos], swapped_rows], ignore_index=True).take(out_position[positions])
+    else:
+        out = df.take(positions)
+
+    out = out.reset_index(drop=True)
+    if state["pids"] is not None:
+        pids = state["pids"][positions]
+        if isinstance(df["participant_identifier"].dtype, pd.CategoricalDtype):
+            pids = pd.Categorical(pids)
+        out["participant_identifier"] = pids
+    return out
+
+
+def apply_id_plan_to_df(df, plan):
+    """
+    Applies a plan (see compile_id_plan) to one file in a single pass. Deletions, exchanges and merges
+    only look up the rows of the IDs they concern and are recorded on arrays; the file is rebuilt
+    (and sorted) once at the end, and not copied at all if nothing changed. A file without IDs of
+    the plan (see plan_ids) is returned as it is, also when other files are sorted by the merges.
+
+    Returns:
+        df (pd.DataFrame): Updated DataFrame (the input itself is not modified).
+        delete_log, exchange_log, merge_log (list): (operation number in the plan, record) pairs.
+        conflicts (list): (operation number in the plan, differences of one merge conflict) pairs,
+            see compare_merge_rows.
+    """
+    if "participant_identifier" not in df.columns:
+        return df, [], [], [], []
+
+    state = _new_id_state(df)
+    delete_log = _delete_ids(state, plan["delete"])
+    if "visit_name" not in df.columns:
+        return _materialize(state), delete_log, [], [], []
+
+    exchange_log = _exchange_ids(state, plan["exchange"])
+    merge_log, conflicts = _merge_ids(state, plan["merge"])
+    if plan_ids(plan).isdisjoint(state["index"]["codes"]):
+        return df, delete_log, exchange_log, merge_log, conflicts
+    return _materialize(state), delete_log, exchange_log, merge_log, conflicts
+
+
+def apply_id_plan(plan, dfs, file_logs=None):
+    """
+    Applies a plan (see compile_id_plan) file by file.
+
+    Returns:
+        dfs (dict): Updated DataFrames.
+        delete_log, exchange_log, merge_log (list): Records in reference table order, then file order.
+        conflict_report (pd.DataFrame): One row per differing value of the merge conflicts
+            (filename, cid, mid, visit, row, column, cid_value, mid_value), in the same order.
+    """
+    def keep(file, df):
+        dfs[file] = df
+
+    return (dfs, *apply_id_plan_to_files(plan, list(dfs.items()), keep, file_logs))
+
+
+def apply_id_plan_to_files(plan, files, on_result, file_logs=None):
+    """
+    Applies a plan to every (file name, DataFrame) yielded by files and hands each updated
+    DataFrame to on_result(file name, df). Only the logs are kept, so files can be read and
+    written one at a time.
+
+    With file_logs (file name -> logs of one file, see combine_id_logs), the logs of the files are
+    added to it and the returned logs cover all of its files in its order, e.g. also those of files
+    processed in an earlier run (None for files without logs).
+
+    Returns:
+        delete_log, exchange_log, merge_log, conflict_report: See apply_id_plan.
+    """
+    file_logs = {} if file_logs is None else file_logs
+    for file, df in files:
+        with run_report.file_entry("id_processing", file) as entry:
+            entry["rows_in"] = len(df)
+            df, delete_log, exchange_log, merge_log, conflicts = apply_id_plan_to_df(df, plan)
+            entry["rows_out"] = len(df)
+            on_result(file, df)
+        del df  # not kept while the next file is read
+        for name, log in (("delete_records", delete_log), ("exchange_records", exchange_log),
+                          ("merge_records", merge_log)):
+            run_report.count("id_processing", name, len(log))
+        run_report.count("id_processing", "merge_conflicts", len(conflicts))
+        file_logs[file] = {"delete": delete_log, "exchange": exchange_log, "merge": merge_log, "conflicts": conflicts}
+
+    for op in plan["merge"]:
+        print(f"--- Merging process btw {op['current_id']} and {op['merge_id']} is complete. ---")
+
+    n_conflicts = sum(len(logs["conflicts"]) for logs in file_logs.values() if logs is not None)
+    if n_conflicts:
+        print(f"⚠️ {n_conflicts} merge conflict(s) need a manual check, see _merge_conflicts.csv")
+    return combine_id_logs(file_logs)
+
+
+def combine_id_logs(file_logs):
+    """
+    Combines the logs of single files into the logs of the run.
+
+    Args:
+        file_logs (dict): File name -> logs of the file, in file order: 'delete', 'exchange', 'merge'
+            ((operation number in the plan, record) pairs, see apply_id_plan_to_df) and 'conflicts'
+            ((operation number, differences) pairs, the differences may also be lists of records); or None.
+
+    Returns:
+        delete_log, exchange_log, merge_log, conflict_report: See apply_id_plan.
+    """
+    logs = ([], [], [])
+    conflicts = []
+    for file_number, (file, logs_of_file) in enumerate(file_logs.items()):
+        if logs_of_file is None:
+            continue
+        for log, name in zip(logs, ("delete", "exchange", "merge")):
+            log.extend((step, file_number, {"filename": file, **record}) for step, record in logs_of_file[name])
+        conflicts.extend((step, file_number, pd.DataFrame(differences).assign(filename=file))
+                         for step, differences in logs_of_file["conflicts"])
+
+    delete_log, exchange_log, merge_log = (
+        [record for _, _, record in sorted(log, key=lambda entry: entry[:2])] for log in logs
+    )
+    conflicts = [differences for _, _, differences in sorted(conflicts, key=lambda entry: entry[:2])]
+    conflict_report = pd.concat(conflicts, ignore_index=True) if conflicts else pd.DataFrame()
+    conflict_report = conflict_report.reindex(columns=CONFLICT_COLUMNS)
+    return delete_log, exchange_log, merge_log, conflict_report
+
+
+def _plan_only(plan, action):
+    return {**plan, **{key: [] for key in ("delete", "exchange", "merge") if key != action}}
+
 
+def apply_delete_operations(df_ref, dfs):
+    dfs, delete_log, _, _, _ = apply_id_plan(_plan_only(compile_id_plan(df_ref), "delete"), dfs)
+    return dfs, delete_log
+
+
+def apply_exchange_operations(df_ref, dfs):
+    dfs, _, exchange_log, _, _ = apply_id_plan(_plan_only(compile_id_plan(df_ref), "exchange"), dfs)
     return dfs, exchange_log
 
 
@@ -147,140 +860,54 @@ def apply_merge_operations(df_ref, dfs):
     - If none exist, fall back to act4_merge_until + act4_also_visit and follow this logic:
 
       (1) For each visit, check whether rows exist for cid and/or mid.
-      (2) Compare values from the 'diary_date' column up to the 5th column from the end:
+      (2) Compare values of all columns after 'diary_date', row by row (see compare_merge_rows):
           - If all mid values are empty → keep cid
-          - If values are equal → keep cid
-          - If values are different → log as conflict
+          - If all rows are equal → keep cid
+          - Otherwise → log as conflict (the differing values are listed in the conflict report)
+
+    Only files containing cid or mid are rebuilt, and sorted by participant_identifier.
     """
-    merge_log = []
+    dfs, _, _, merge_log, _ = apply_id_plan(_plan_only(compile_id_plan(df_ref), "merge"), dfs)
+    return dfs, merge_log
 
-    for _, row in df_ref.iterrows():
-        cid = row["current_id"]
-        act4 = str(row["act4_merge"]).strip()
 
-        if "1" in act4 or "2" in act4:
-            mid = row["act4_merge_id"]
-            visits_merge = row["act4_merge_visit"]
-            visits_until = row["act4_merge_until"]
-            visits_also = row["act4_also_visit"]
-            final_id = row["final_id"]
-
-            for file, df in dfs.items():
-                if "participant_identifier" not in df.columns or "visit_name" not in df.columns:
-                    continue
+def run_id_processing(df_ref, dfs, plan=None, file_logs=None):
+    """
+    Applies deletion, exchange and merge operations of the reference table to DataFrames already in memory.
+    The reference table is compiled into a plan once and every file is processed in a single pass.
 
-                existing_visits = set(visits_merge).intersection(df["visit_name"].unique()) if isinstance(visits_merge, list) else set()
-
-                if existing_visits:
-                    # Merge based on act4_merge_visit
-                    common_visits = list(existing_visits)
-                    mask_cid = (df["participant_identifier"] == cid) & (df["visit_name"].isin(common_visits))
-                    df = df[~mask_cid]
-
-                    mask_mid = (df["participant_identifier"] == mid) & (df["visit_name"].isin(common_visits))
-                    rows_to_move = df[mask_mid].copy()
-                    rows_moved_count = len(rows_to_move)
-                    rows_to_move["participant_identifier"] = cid
-
-                    df = df[df["participant_identifier"] != mid]
-                    rows_to_move["participant_identifier"] = final_id
-                    df.loc[df["participant_identifier"] == cid, "participant_identifier"] = final_id
-
-                    df = pd.concat([df, rows_to_move], ignore_index=True)
-                    df = df.sort_values(by=["participant_identifier"]).reset_index(drop=True)
-                    dfs[file] = df
-
-                    merge_log.append({
-                        "filename": file,
-                        "current_id": cid,
-                        "merge_id": mid,
-                        "final_id": final_id,
-                        "visits_merged": visits_merge,
-                        "common_visits": common_visits,
-                        "rows_moved": rows_moved_count,
-                        "note": "merged by act4_merge_visit"
-                    })
+    Args:
+        df_ref (pd.DataFrame): Reference table, see load_reference_excel.
+        dfs (dict): File name -> DataFrame. The dict itself is not modified.
+        plan (dict, optional): Plan compiled from df_ref (see compile_id_plan), compiled here if not given.
+        file_logs (dict, optional): Logs per file, also of files not in dfs, see apply_id_plan_to_files.
 
-                else:
-                    # Merge based on act4_merge_until + act4_also_visit (i.e., process all other visits)
-                    until_visits = []
-                    if isinstance(visits_until, list):
-                        until_visits.extend(visits_until)
-                    if isinstance(visits_also, list):
-                        until_visits.extend(visits_also)
-                    until_visits = [v.strip() for v in until_visits if v.strip()]
-
-                    diary_col_idx = df.columns.get_loc("diary_date") + 1
-                    # set no ending idx as csv-files have different amount of columns
-                    data_cols = df.columns[diary_col_idx:]  
-
-                    for visit in until_visits:
-                        cid_mask = (df["participant_identifier"] == cid) & (df["visit_name"] == visit)
-                        mid_mask = (df["participant_identifier"] == mid) & (df["visit_name"] == visit)
-
-                        if not cid_mask.any() and not mid_mask.any():
-                            continue
-
-                        cid_row = df[cid_mask]
-                        mid_row = df[mid_mask]
-
-                        if cid_row.empty and not mid_row.empty:
-                            df.loc[mid_mask, "participant_identifier"] = cid
-                            df.loc[df["participant_identifier"] == cid, "participant_identifier"] = final_id
-                            merge_log.append({
-                                "filename": file, "visit": visit, "cid": cid, "mid": mid,
-                                "final_id": final_id, "action": "mid only → moved to cid (act4_until)"
-                            })
-
-                        elif not cid_row.empty and mid_row.empty:
-                            df = df[~mid_mask]
-                            df.loc[df["participant_identifier"] == cid, "participant_identifier"] = final_id
-                            merge_log.append({
-                                "filename": file, "visit": visit, "cid": cid, "mid": mid,
-                                "final_id": final_id, "action": "cid only → kept (act4_until)"
-                            })
-
-                        elif not cid_row.empty and not mid_row.empty:
-                            cid_vals = cid_row[data_cols].values
-                            mid_vals = mid_row[data_cols].values
-
-                            cid_data = ["" if pd.isna(x) else str(x).strip() for x in cid_vals[0]]
-                            mid_data = ["" if pd.isna(x) else str(x).strip() for x in mid_vals[0]]
-
-                            if all(x == "" for x in mid_data):
-                                df = df[~mid_mask]
-                                df.loc[df["participant_identifier"] == cid, "participant_identifier"] = final_id
-                                merge_log.append({
-                                    "filename": file, "visit": visit, "cid": cid, "mid": mid,
-                                    "final_id": final_id, "action": "mid empty → kept cid (act4_until)"
-                                })
-
-                            elif cid_data == mid_data:
-                                df = df[~mid_mask]
-                                df.loc[df["participant_identifier"] == cid, "participant_identifier"] = final_id
-                                merge_log.append({
-                                    "filename": file, "visit": visit, "cid": cid, "mid": mid,
-                                    "final_id": final_id, "action": "both same → kept cid (act4_until)"
-                                })
-
-                            else:
-                                print("📌 비교 컬럼:", list(data_cols))
-                                print("CID data:", cid_data)
-                                print("MID data:", mid_data)
-                                merge_log.append({
-                                    "filename": file, "visit": visit, "cid": cid, "mid": mid,
-                                    "final_id": final_id, "action": "conflict → manual check needed"
-                                })
-                                print(f"[CONFLICT] {file} - {cid} vs {mid} @ {visit}: data mismatch")
-
-                    df = df.sort_values(by=["participant_identifier"]).reset_index(drop=True)
-                    dfs[file] = df
-            print(f"--- Merging process btw {cid} and {mid} is complete. ---")
+    Returns:
+        dfs (dict): Updated DataFrames.
+        delete_log (list): Deletion records.
+        exchange_log (list): Exchange records.
+        merge_log (list): Merge records.
+        conflict_report (pd.DataFrame): Differing values of the merge conflicts, see apply_id_plan.
+    """
+    if plan is None:
+        plan = compile_id_plan(df_ref)
+    return apply_id_plan(plan, dict(dfs), file_logs)
 
-    return dfs, merge_log
+
+def save_id_processing_logs(delete_log, exchange_log, merge_log, save_path, conflict_report=None):
+    """
+    Saves the deletion, exchange and merge logs (and the merge conflict report, if given) to save_path.
+    """
+    os.makedirs(save_path, exist_ok=True)
+    pd.DataFrame(delete_log).to_csv(os.path.join(save_path, "_delete_log.csv"), sep=';', index=False, encoding='utf-8-sig')
+    pd.DataFrame(exchange_log).to_csv(os.path.join(save_path, "_exchange_log.csv"), sep=';', index=False, encoding='utf-8-sig')
+    pd.DataFrame(merge_log).to_csv(os.path.join(save_path, "_merge_log.csv"), sep=';', index=False, encoding='utf-8-sig')
+    if conflict_report is not None:
+        conflict_report.to_csv(os.path.join(save_path, "_merge_conflicts.csv"), sep=';', index=False, encoding='utf-8-sig')
 
 
-def run_id_processing_and_save(refer_path, base_path, save_path):
+def run_id_processing_and_save(refer_path, base_path, save_path, input_format="csv", output_format="csv",
+                               one_file_at_a_time=False, read_workers=READ_WORKERS, csv_engine=None):
     """
     Process deletion and move operations for participant IDs,
     and save updated CSV files and logs to save_path.
@@ -289,6 +916,14 @@ def run_id_processing_and_save(refer_path, base_path, save_path):
         refer_path (str): Path to reference Excel file.
         base_path (str): Path to input CSV files.
         save_path (str): Path to save updated CSVs and logs.
+        input_format (str): Format of the input files: 'csv', 'parquet' or 'feather'.
+        output_format (str or list): Format(s) of the output files, e.g. ['csv', 'parquet'].
+        one_file_at_a_time (bool): Read, process and write the files one by one, so only one file
+            (and the files read ahead) is in memory; the updated DataFrames are then not returned (dfs is empty).
+            CSV files without IDs of the reference table are then only scanned and copied as they are
+            (see iter_plan_csvs), if the output is CSV only.
+        read_workers (int): Number of files read at the same time (and read ahead), see iter_csvs.
+        csv_engine (str, optional): 'pyarrow' to parse the CSV files with the multi-threaded pyarrow reader.
 
     Returns:
         dfs (dict): Updated DataFrames.
@@ -297,31 +932,47 @@ def run_id_processing_and_save(refer_path, base_path, save_path):
     """
 
 
-    # 1. Load reference table and CSV files
+    # 1. Load reference table
     df_ref = load_reference_excel(refer_path)
-    dfs = load_all_csvs(base_path)
-    remember_original_data = {}
-
-    # 2. Apply deletion
-    dfs, delete_log = apply_delete_operations(df_ref, dfs)
-
-    # 3. Apply exchang
-    dfs, exchange_log = apply_exchange_operations(df_ref, dfs)
-
-    # 4. Apply
-    dfs, merge_log = apply_merge_operations(df_ref, dfs)
-
-    # 4. Save updated CSVs to save_path
+    plan = compile_id_plan(df_ref)
     os.makedirs(save_path, exist_ok=True)
-    for filename, df in dfs.items():
-        out_path = os.path.join(save_path, filename)
-        df.to_csv(out_path, sep=';', index=False, encoding='utf-8')
-
-    # 5. Save logs
-    pd.DataFrame(delete_log).to_csv(os.path.join(save_path, "_delete_log.csv"), sep=';', index=False, encoding='utf-8-sig')
-    pd.DataFrame(exchange_log).to_csv(os.path.join(save_path, "_exchange_log.csv"), sep=';', index=False, encoding='utf-8-sig')
-    pd.DataFrame(merge_log).to_csv(os.path.join(save_path, "_merge_log.csv"), sep=';', index=False, encoding='utf-8-sig')
 
+    if one_file_at_a_time:
+        # 2.-5. Load, apply deletion, exchange and merge, and save every file before the next one is read
+        scans = {}
+
+        def save_file(filename, df):
+            if df is scans.pop(filename, None):
+                # Scanned file without IDs of the plan, left as it is
+                copy_table(base_path, save_path, filename)
+                run_report.count("id_processing", "files_copied")
+            else:
+                write_table(df, save_path, filename, output_format, encoding='utf-8')
+            run_report.record("id_processing", filename, bytes_written=stored_bytes(save_path, filename, output_format))
+
+        if input_format == "csv" and output_formats(output_format) == ("csv",):
+            files = iter_plan_csvs(plan, base_path, read_workers, csv_engine, scans)
+        else:
+            files = iter_csvs(base_path, input_format, read_workers, csv_engine)
+
+        dfs = {}
+        delete_log, exchange_log, merge_log, conflict_report = apply_id_plan_to_files(plan, files, save_file)
+    else:
+        # 2. Load CSV files
+        dfs = load_all_csvs(base_path, input_format, read_workers, csv_engine)
+
+        # 3.-4. Apply deletion, exchange and merge
+        dfs, delete_log, exchange_log, merge_log, conflict_report = run_id_processing(df_ref, dfs, plan)
+
+        # 5. Save updated CSVs to save_path
+        for filename, df in dfs.items():
+            with run_report.file_entry("id_processing", filename) as entry:
+                write_table(df, save_path, filename, output_format, encoding='utf-8')
+                entry["bytes_written"] = stored_bytes(save_path, filename, output_format)
+
+    # 6. Save logs and the plan
+    save_id_processing_logs(delete_log, exchange_log, merge_log, save_path, conflict_report)
+    save_id_plan(plan, save_path)
 
     return dfs, delete_log, exchange_log, merge_log
 
@@ -0,0 +1,552 @@
+import csv
+import io
+import os
+import shutil
+import threading
+import time
+import warnings
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from pandas.errors import ParserWarning
+import run_report
+from dtype_utils import CATEGORY_COLUMNS, compact_dtypes, csv_dtypes
+
+# Files of the MaganaMed export that are not forms and are never processed
+EXCLUDED_FILES = {"participants.csv", "study-queries.csv", "study-participant-forms.csv"}
+
+# File formats the stages can read and write -> file extension.
+# Files are always named by their export name ('<form>.csv'); columnar copies replace the extension.
+FILE_FORMATS = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+
+# Files read at the same time by read_tables (reading releases the GIL for most of the parsing)
+READ_WORKERS = 4
+
+# Values pd.read_csv reads as missing by default; the pyarrow reader gets the same list
+CSV_NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA',
+    'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+]
+
+
+def output_formats(output_format):
+    """
+    Normalizes an output format option ('csv', 'parquet', 'feather' or a list of them) to a tuple.
+    """
+    formats = (output_format,) if isinstance(output_format, str) else tuple(output_format)
+    unknown = [f for f in formats if f not in FILE_FORMATS]
+    if unknown or not formats:
+        raise ValueError(f"Unknown output format(s) {unknown or formats}, expected some of {list(FILE_FORMATS)}")
+    return formats
+
+
+def format_path(base_path, file_name, file_format="csv"):
+    """
+    Returns the path of file_name (export name, '<form>.csv') stored as file_format in base_path.
+    """
+    return os.path.join(base_path, os.path.splitext(file_name)[0] + FILE_FORMATS[file_format])
+
+
+def is_archive(base_path):
+    """
+    Returns True if base_path is a ZIP archive (e.g. the MaganaMed export as downloaded) instead of a folder.
+    The files in an archive are read as decompressed streams, without extracting them.
+    """
+    return os.path.isfile(base_path) and zipfile.is_zipfile(base_path)
+
+
+def _archive_members(archive_path):
+    """
+    Returns file name -> ZipInfo of the files in a ZIP archive, in archive order.
+    Files may be in any folder of the archive; the first file of a name is used.
+    The map is read once per version (size and modification time) of the archive and must not be changed.
+    """
+    stat = os.stat(archive_path)
+    return _read_archive_members(os.path.abspath(archive_path), stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=8)
+def _read_archive_members(archive_path, size, mtime_ns):
+    # Cached by _archive_members; size and mtime_ns only make a changed archive a new cache entry
+    members = {}
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                continue
+            members.setdefault(os.path.basename(info.filename), info)
+    return members
+
+
+def _archive_member(archive_path, file_name):
+    info = _archive_members(archive_path).get(file_name)
+    if info is None:
+        raise FileNotFoundError(f"'{file_name}' not found in {archive_path}")
+    return info
+
+
+@contextmanager
+def open_file(path):
+    """
+    Opens path for reading bytes. path may also name a file in an archive (os.path.join(<archive>, <file name>),
+    see is_archive), which is then decompressed while it is read.
+    """
+    archive_path, file_name = os.path.split(path)
+    if not is_archive(archive_path):
+        with open(path, "rb") as f:
+            yield f
+        return
+    info = _archive_member(archive_path, file_name)
+    with zipfile.ZipFile(archive_path) as archive, archive.open(info) as f:
+        yield f
+
+
+@contextmanager
+def _csv_source(path):
+    # The path itself, or the decompressed stream of a file in an archive (see open_file)
+    if not is_archive(os.path.dirname(path)):
+        yield path
+        return
+    with open_file(path) as f:
+        yield f
+
+
+def file_version(base_path, file_name):
+    """
+    Returns [size, modification time] of file_name in base_path, or [size, CRC] for a file in an archive:
+    cheap to get, and changed whenever the content is.
+    """
+    if is_archive(base_path):
+        info = _archive_member(base_path, file_name)
+        return [info.file_size, info.CRC]
+    path = os.path.join(base_path, file_name)
+    return [os.path.getsize(path), os.path.getmtime(path)]
+
+
+def stored_bytes(base_path, file_name, file_format="csv"):
+    """
+    Returns the size in bytes of file_name (export name) stored in base_path in every format of
+    file_format (one or a list, see output_formats); missing files count 0.
+    Files in an archive count their decompressed size.
+    """
+    if is_archive(base_path):
+        info = _archive_members(base_path).get(file_name)
+        return info.file_size if info is not None else 0
+    paths = (format_path(base_path, file_name, f) for f in output_formats(file_format))
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def list_csv_files(base_path, excluded_files=EXCLUDED_FILES, input_format="csv"):
+    """
+    Returns the names of all CSV files in base_path (a folder or an archive, see is_archive), except the excluded ones.
+    With a columnar input_format, returns the export names ('<form>.csv') of the files stored in that format.
+    """
+    extension = FILE_FORMATS[input_format]
+    file_names = _archive_members(base_path) if is_archive(base_path) else os.listdir(base_path)
+    names = [os.path.splitext(f)[0] + ".csv" for f in file_names if f.endswith(extension)]
+    return [f for f in names if f not in excluded_files]
+
+
+def read_table(base_path, file_name, input_format="csv", engine=None, **csv_kwargs):
+    """
+    Reads file_name (export name) from base_path (a folder or an archive, see is_archive) in input_format.
+    CSV files are read as semicolon-separated, with csv_kwargs passed to pd.read_csv
+    (a 'dtype' argument is the dtype of all other columns).
+    The identifier and visit columns (dtype_utils.CATEGORY_COLUMNS) are read as categoricals.
+    With engine='pyarrow', CSV files read as text are parsed by the multi-threaded pyarrow reader
+    where it gives the same result (see _read_csv_pyarrow).
+    """
+    return _read_table(base_path, file_name, input_format, engine, csv_kwargs)[0]
+
+
+def _read_table(base_path, file_name, input_format, engine, csv_kwargs):
+    # read_table, also returning the number of bad lines skipped with on_bad_lines='skip'
+    path = format_path(base_path, file_name, input_format)
+    if input_format == "parquet":
+        return compact_dtypes(pd.read_parquet(path)), 0
+    if input_format == "feather":
+        return compact_dtypes(pd.read_feather(path)), 0
+    if engine == "pyarrow":
+        df = _read_csv_pyarrow(path, csv_kwargs)
+        if df is not None:
+            return df, 0
+    csv_kwargs = {**csv_kwargs, "dtype": csv_dtypes(csv_kwargs.get("dtype"))}
+    with _csv_source(path) as source:
+        if csv_kwargs.get("on_bad_lines") != "skip":
+            return pd.read_csv(source, sep=';', **csv_kwargs), 0
+        with _counting_bad_lines() as bad_lines:
+            df = pd.read_csv(source, sep=';', **{**csv_kwargs, "on_bad_lines": "warn"})
+    return df, bad_lines["count"]
+
+
+def _read_csv_pyarrow(path, csv_kwargs):
+    """
+    Reads a CSV file as text (dtype 'object' or str) or with inferred types (no dtype) with the pyarrow
+    CSV reader, with the same missing values, types and categoricals as pd.read_csv (see _infer_csv_column).
+    Returns None where the result could differ (other arguments, malformed lines, missing, empty or
+    duplicate column names): pd.read_csv is used then.
+    """
+    infer = csv_kwargs.get("dtype") is None
+    if not infer and csv_kwargs.get("dtype") not in ("object", object, str):
+        return None
+    if csv_kwargs.get("encoding", "utf-8") != "utf-8":
+        return None
+    if set(csv_kwargs) - {"dtype", "encoding", "on_bad_lines"}:
+        return None
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    with open_file(path) as f:
+        header = next(csv.reader(io.TextIOWrapper(f, encoding="utf-8-sig", newline=""), delimiter=';'), None)
+    if not header or "" in header or len(set(header)) != len(header):
+        return None
+    try:
+        with _csv_source(path) as source:
+            table = pa_csv.read_csv(
+                source,
+                parse_options=pa_csv.ParseOptions(delimiter=';', newlines_in_values=True),
+                convert_options=pa_csv.ConvertOptions(
+                    column_types={col: pa.string() for col in header}, null_values=CSV_NA_VALUES,
+                    strings_can_be_null=True, quoted_strings_can_be_null=True,
+                ),
+            )
+    except pa.ArrowInvalid:
+        # Lines with too many or too few fields (pd.read_csv skips or pads them), or not UTF-8
+        return None
+
+    data = {}
+    for col, column in zip(table.column_names, table.columns):
+        if col in CATEGORY_COLUMNS:
+            # Categories sorted like those of pd.read_csv
+            values = column.dictionary_encode().to_pandas()
+            data[col] = values.cat.set_categories(sorted(values.cat.categories))
+            continue
+        values = column.to_pandas().to_numpy()
+        is_null = column.is_null().to_numpy(zero_copy_only=False)
+        if column.null_count:
+            values[is_null] = np.nan  # None -> NaN, as read by pd.read_csv
+        data[col] = _infer_csv_column(values, is_null) if infer else values
+    return pd.DataFrame(data, columns=table.column_names)
+
+
+# Values the C parser of pd.read_csv reads as booleans
+_CSV_BOOLEANS = {"True": True, "TRUE": True, "true": True, "False": False, "FALSE": False, "false": False}
+
+
+def _infer_csv_column(values, is_null):
+    """
+    Converts the text values (NaN where missing) of one CSV column like pd.read_csv infers its type:
+    all missing -> float64, all numbers -> int64/uint64 (float64 with missing values or decimals),
+    all booleans -> bool (object with missing values), otherwise text.
+    """
+    if is_null.all():
+        return np.full(len(values), np.nan)
+    try:
+        return pd.to_numeric(values)
+    except (ValueError, TypeError):
+        pass
+    present = values[~is_null]
+    if all(value in _CSV_BOOLEANS for value in set(present)):
+        if not is_null.any():
+            return np.array([_CSV_BOOLEANS[value] for value in values], dtype=bool)
+        values[~is_null] = [_CSV_BOOLEANS[value] for value in present]
+    return values
+
+
+# The C parser only reports skipped bad lines as ParserWarnings. While a thread reads a file with
+# on_bad_lines='skip', these warnings are counted for that thread instead of shown. The hook is installed
+# once and delegates everything else to the showwarning it replaced; the warning filters are not changed.
+_bad_lines = threading.local()
+
+
+def _show_warning(message, category, filename, lineno, file=None, line=None):
+    counter = getattr(_bad_lines, "counter", None)
+    if counter is not None and issubclass(category, ParserWarning) and "Skipping line" in str(message):
+        counter["count"] += str(message).count("Skipping line")
+        # Identical warnings of other files must not be suppressed as repeats (see warnings.warn_explicit)
+        globals().get("__warningregistry__", {}).pop((str(message), category, lineno), None)
+        return
+    _show_warning.delegate(message, category, filename, lineno, file, line)
+
+
+_show_warning.delegate = warnings.showwarning
+warnings.showwarning = _show_warning
+
+
+@contextmanager
+def _counting_bad_lines():
+    """
+    Yields a dict whose 'count' is the number of lines skipped by pd.read_csv(on_bad_lines='warn')
+    in the current thread (skipped lines are only counted while ParserWarnings are not ignored).
+    """
+    _bad_lines.counter = {"count": 0}
+    try:
+        yield _bad_lines.counter
+    finally:
+        _bad_lines.counter = None
+
+
+def _timed_read(base_path, file_name, input_format, engine, csv_kwargs):
+    start = time.perf_counter()
+    df, skipped = _read_table(base_path, file_name, input_format, engine, csv_kwargs)
+    return df, skipped, time.perf_counter() - start
+
+
+def read_tables(base_path, file_names, input_format="csv", workers=READ_WORKERS, engine=None,
+                report_stage="read", **csv_kwargs):
+    """
+    Reads file_names (export names) from base_path like read_table, up to workers files at the same time
+    in a thread pool, and yields (file name, DataFrame) in file order; if a file cannot be read, the exception
+    is yielded instead of the DataFrame. At most workers files are read ahead of the one yielded.
+
+    The read time of every file is added to its report_stage entry of the run report. With
+    on_bad_lines='skip', the skipped lines of every file are printed and added to the run report
+    ('skipped_lines' of the file and of the stage counters).
+    """
+    read_ahead = max(1, workers or 1)
+    names = iter(file_names)
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=read_ahead) as executor:
+        def submit_next():
+            file_name = next(names, None)
+            if file_name is not None:
+                pending.append((file_name, executor.submit(_timed_read, base_path, file_name, input_format,
+                                                           engine, csv_kwargs)))
+
+        for _ in range(read_ahead):
+            submit_next()
+        while pending:
+            file_name, future = pending.popleft()
+            submit_next()
+            try:
+                df, skipped, seconds = future.result()
+            except Exception as e:
+                yield file_name, e
+                continue
+            run_report.record(report_stage, file_name, seconds=seconds)
+            if skipped:
+                print(f"⚠️ {file_name}: {skipped} malformed line(s) skipped")
+                run_report.record(report_stage, file_name, skipped_lines=skipped)
+                run_report.count(report_stage, "skipped_lines", skipped)
+            yield file_name, df
+            del df  # not kept while the next file is read
+
+
+def write_table(df, save_path, file_name, output_format="csv", **csv_kwargs):
+    """
+    Writes df as file_name (export name) to save_path in every format of output_format.
+    CSV files are semicolon-separated without index, with csv_kwargs passed to to_csv;
+    Parquet and Feather files keep the dtypes (including nullable Int64).
+    """
+    for file_format in output_formats(output_format):
+        path = format_path(save_path, file_name, file_format)
+        if file_format == "parquet":
+            df.to_parquet(path, index=False)
+        elif file_format == "feather":
+            df.reset_index(drop=True).to_feather(path)
+        else:
+            df.to_csv(path, sep=';', index=False, **csv_kwargs)
+
+
+def copy_table(base_path, save_path, file_name, file_format="csv"):
+    """
+    Copies file_name (export name) in file_format from base_path (a folder or an archive) to save_path
+    byte for byte, e.g. for a file a stage leaves unchanged, without parsing it.
+    """
+    with open_file(format_path(base_path, file_name, file_format)) as source, \
+            open(format_path(save_path, file_name, file_format), "wb") as target:
+        shutil.copyfileobj(source, target, 1 << 20)
+
+
+def read_table_chunks(base_path, file_name, input_format="csv", chunksize=100_000, **csv_kwargs):
+    """
+    Reads file_name (export name) from base_path in input_format as DataFrames of at most chunksize rows,
+    with the same dtypes as read_table. Feather files are read in the record batches they were written with.
+    """
+    path = format_path(base_path, file_name, input_format)
+    if input_format == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield compact_dtypes(batch.to_pandas())
+    elif input_format == "feather":
+        import pyarrow as pa
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield compact_dtypes(reader.get_batch(i).to_pandas())
+    else:
+        csv_kwargs["dtype"] = csv_dtypes(csv_kwargs.get("dtype"))
+        with _csv_source(path) as source, pd.read_csv(source, sep=';', chunksize=chunksize, **csv_kwargs) as reader:
+            yield from reader
+
+
+def append_csv(df, save_path, file_name, first, **csv_kwargs):
+    """
+    Writes one chunk of file_name to save_path as semicolon-separated CSV:
+    the first chunk creates the file with the header, later chunks are appended.
+    """
+    df.to_csv(os.path.join(save_path, file_name), sep=';', index=False,
+              mode='w' if first else 'a', header=first, **csv_kwargs)
+
+
+def _column_runs(columns, drop_columns):
+    """
+    Splits columns into runs of consecutive columns that are all kept or all dropped in the subset.
+
+    Returns:
+        runs (list): (columns, kept) tuples in column order.
+    """
+    runs = []
+    for col in columns:
+        kept = col not in drop_columns
+        if runs and runs[-1][1] == kept:
+            runs[-1][0].append(col)
+        else:
+            runs.append(([col], kept))
+    return runs
+
+
+def _csv_lines(df, runs, header):
+    """
+    Renders df as CSV lines (to_csv with ';') once per run of columns, without line terminators.
+    Returns one list of lines ([header,] rows...) per run, or None if a value contains a line break.
+    """
+    segments = []
+    for columns, _ in runs:
+        lines = df[columns].to_csv(sep=';', index=False, header=header, lineterminator='\n').split('\n')[:-1]
+        if len(lines) != len(df) + header:
+            return None
+        if len(columns) == 1:
+            # A single column writes missing values as "" (to tell them from empty lines)
+            lines = ['' if line == '""' else line for line in lines]
+        segments.append(lines)
+    return segments
+
+
+def _join_segments(segments, n_columns):
+    """
+    Joins per-run lines to full CSV lines; with a single column, empty values are written as "" like to_csv.
+    """
+    if n_columns == 1:
+        return ['""' if line == '' else line for line in segments[0]]
+    return [';'.join(parts) for parts in zip(*segments)]
+
+
+def _write_csv_and_subset(df, path, subset_path, rows, drop_columns, mode, header, encoding):
+    """
+    Writes df to path and its subset to subset_path as CSV (like to_csv), formatting every value once:
+    the rows of both files are joined from the same per-run lines.
+    """
+    runs = _column_runs(list(df.columns), drop_columns)
+    segments = _csv_lines(df, runs, header) if any(kept for _, kept in runs) else None
+    if segments is None:
+        # Values with line breaks (or no columns left in the subset): format both files separately
+        df.to_csv(path, sep=';', index=False, mode=mode, header=header, encoding=encoding)
+        df.loc[rows, [col for col in df.columns if col not in drop_columns]].to_csv(
+            subset_path, sep=';', index=False, mode=mode, header=header, encoding=encoding)
+        return
+
+    full_lines = _join_segments(segments, len(df.columns))
+    subset_lines = _join_segments([lines for lines, (_, kept) in zip(segments, runs) if kept],
+                                  sum(len(columns) for columns, kept in runs if kept))
+    selected = np.flatnonzero(np.concatenate([[True] * header, rows]))
+    for file_path, lines in ((path, full_lines), (subset_path, [subset_lines[i] for i in selected])):
+        with open(file_path, mode, encoding=encoding, newline='') as f:
+            f.writelines(line + os.linesep for line in lines)
+
+
+def write_table_and_subset(df, save_path, subset_path, file_name, rows, drop_columns, output_format="csv",
+                           encoding='utf-8'):
+    """
+    Writes df to save_path and the subset of its rows (boolean array) without drop_columns to subset_path,
+    in every format of output_format, with the same content as two write_table calls. The shared data is
+    serialized once: CSV values are formatted once for both files, columnar formats convert df to one
+    Arrow table and filter it. No filtered DataFrame is built.
+    """
+    rows = np.asarray(rows, dtype=bool)
+    for file_format in output_formats(output_format):
+        path = format_path(save_path, file_name, file_format)
+        sub_path = format_path(subset_path, file_name, file_format)
+        if file_format == "csv":
+            _write_csv_and_subset(df, path, sub_path, rows, drop_columns, 'w', True, encoding)
+            continue
+
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+        subset = table.filter(pa.array(rows)).drop_columns([col for col in drop_columns if col in df.columns])
+        if file_format == "parquet":
+            import pyarrow.parquet as pq
+            pq.write_table(table, path)
+            pq.write_table(subset, sub_path)
+        else:
+            import pyarrow.feather as feather
+            feather.write_feather(table, path)
+            feather.write_feather(subset, sub_path)
+
+
+def append_csv_and_subset(df, save_path, subset_path, file_name, rows, drop_columns, first, encoding='utf-8'):
+    """
+    Chunked variant of write_table_and_subset for CSV: the first chunk creates both files
+    with their header, later chunks are appended.
+    """
+    _write_csv_and_subset(df, os.path.join(save_path, file_name), os.path.join(subset_path, file_name),
+                          np.asarray(rows, dtype=bool), drop_columns, 'w' if first else 'a', first, encoding)
+
+
+def check_chunked_format(output_format):
+    """
+    Chunked (streaming) stages append to CSV files only; raises ValueError for columnar output formats.
+    """
+    if output_formats(output_format) != ("csv",):
+        raise ValueError("Chunked processing only writes CSV, use output_format='csv' or no chunksize.")
+
+
+def load_export(base_path, excluded_files=EXCLUDED_FILES, file_names=None, input_format="csv", workers=READ_WORKERS,
+                engine=None):
+    """
+    Reads every form CSV of the export once and keeps it in memory.
+
+    Args:
+        base_path (str): Path to the MaganaMed export (folder or ZIP file).
+        excluded_files (set): File names that are not loaded.
+        file_names (list, optional): Only these files are loaded (default: all form CSVs).
+        input_format (str): 'csv', 'parquet' or 'feather' (see FILE_FORMATS).
+        workers (int): Number of files read at the same time (see read_tables).
+        engine (str, optional): 'pyarrow' to parse the CSV files with the multi-threaded pyarrow reader.
+
+    Returns:
+        dfs (dict): File name -> DataFrame, in directory listing order.
+    """
+    if file_names is None:
+        file_names = list_csv_files(base_path, excluded_files, input_format)
+
+    dfs = {}
+    for file_name, df in read_tables(base_path, file_names, input_format, workers, engine, report_stage="load_export",
+                                     encoding='utf-8'):
+        if isinstance(df, Exception):
+            print(f"❌ Failed to read {file_name}: {df}")
+            continue
+        with run_report.file_entry("load_export", file_name) as entry:
+            dfs[file_name] = df
+            entry.update(rows_out=len(df), bytes_read=stored_bytes(base_path, file_name, input_format))
+    return dfs
+
+
+def save_dfs(dfs, save_path, output_format="csv", report_stage="save_dfs"):
+    """
+    Writes every DataFrame in dfs to save_path/<file name> as semicolon-separated CSV
+    (and/or Parquet/Feather, see write_table). The writes are recorded as report_stage in the run report.
+    """
+    os.makedirs(save_path, exist_ok=True)
+    for file_name, df in dfs.items():
+        with run_report.file_entry(report_stage, file_name) as entry:
+            try:
+                write_table(df, save_path, file_name, output_format, encoding='utf-8')
+            except Exception as e:
+                print(f"❌ Failed to save {file_name}: {e}")
+                continue
+            entry.update(rows_in=len(df), bytes_written=stored_bytes(save_path, file_name, output_format))
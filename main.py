@@ -3,10 +3,9 @@ import numpy as np
 import os
 import yaml
 from datetime import datetime
-import base_variables
-import measure_calculation_woCopy
-import id_processing
-import merge_redcap_n_maganamed
+import pipeline
+import run_report
+from io_utils import output_formats
 
 
 # Read configuration file
@@ -24,21 +23,77 @@ save_path_idProcessed = config['maganamedPath']['save_path_idProcessed']
 save_path_redcapIntegrated = config['maganamedPath']['save_path_redcapIntegrated'] # Config 추가
 
 
+# Intermediate outputs of stages (1)-(3) are only written for debugging (config: pipeline/write_intermediate)
+write_intermediate = config.get('pipeline', {}).get('write_intermediate', False)
+# Only reprocess export files that changed since the last run (config: pipeline/incremental)
+incremental = config.get('pipeline', {}).get('incremental', False)
+# Output file format(s): 'csv', 'parquet', 'feather' or a list, e.g. [csv, parquet] (config: pipeline/output_format)
+output_format = config.get('pipeline', {}).get('output_format', 'csv')
+# For exports too large for memory, process in chunks of this many rows (config: pipeline/chunksize)
+chunksize = config.get('pipeline', {}).get('chunksize')
+# Process the files of the per-file stages in this many worker processes (config: pipeline/workers)
+workers = config.get('pipeline', {}).get('workers')
+# Run the stages as (stage, file) tasks, pipelined across files and resumable after a crash (config: pipeline/scheduled)
+scheduled = config.get('pipeline', {}).get('scheduled', False)
+# Parse the export CSV files (in the file-based pipelines: those of the ID processing) with the multi-threaded
+# pyarrow reader (config: pipeline/csv_engine)
+csv_engine = config.get('pipeline', {}).get('csv_engine')
+# Run report (_run_report.json next to the REDCap-integrated outputs) with time, rows, bytes and memory
+# per stage and file (config: pipeline/report); optional tracemalloc peaks and cProfile per stage
+report = config.get('pipeline', {}).get('report', False)
+trace_memory = config.get('pipeline', {}).get('trace_memory', False)
+profile_stages = config.get('pipeline', {}).get('profile', [])
+
+# The file-based pipelines (chunksize, workers or scheduled) always reprocess all files and write
+# the intermediate folders, as CSV only
+if scheduled or chunksize or workers:
+    unsupported = []
+    if incremental:
+        unsupported.append("incremental: true")
+    if output_formats(output_format) != ("csv",):
+        unsupported.append(f"output_format: {output_format}")
+    if config.get('pipeline', {}).get('write_intermediate') is False:
+        unsupported.append("write_intermediate: false")
+    if unsupported:
+        raise ValueError(f"Not supported with pipeline/chunksize, workers or scheduled: {', '.join(unsupported)}. "
+                         f"Remove these options, or chunksize, workers and scheduled to run the in-memory pipeline.")
+
+
 # Call the processing function
 # (1) add base variables (SiteCode, VisitCode)
-base_variables.add_sitecode_column(base_path_maganamed, save_path_baseVar)
-base_variables.add_visitcode_column(save_path_baseVar, save_path_baseVar)
-
 # (2) add calculated values
-measure_calculation_woCopy.calculate_and_save(save_path_baseVar, save_path_calVar)
-measure_calculation_woCopy.copy_unprocessed_files(save_path_baseVar, save_path_calVar)
-
 # (3) perform the id processing
-dfs, delete_log, exchange_log, merge_log  = id_processing.run_id_processing_and_save(base_path_reference, save_path_calVar, save_path_idProcessed)
-
 # (4) Integrate REDCap and filtering
+if report:
+    run_report.start_report(trace_memory=trace_memory, profile_stages=profile_stages,
+                            settings=config.get('pipeline', {}))
+
 df_redcapInfos = pd.read_csv(base_path_redcap, sep=';')
-merge_redcap_n_maganamed.merge_redcap_n_maganamed(df_redcapInfos, save_path_idProcessed, save_path_redcapIntegrated)
+if scheduled:
+    pipeline.run_pipeline_scheduled(
+        base_path_maganamed, base_path_reference, df_redcapInfos, save_path_redcapIntegrated,
+        save_path_baseVar, save_path_calVar, save_path_idProcessed, chunksize=chunksize, workers=workers,
+        csv_engine=csv_engine
+    )
+elif chunksize or workers:
+    pipeline.run_pipeline_streaming(
+        base_path_maganamed, base_path_reference, df_redcapInfos, save_path_redcapIntegrated,
+        save_path_baseVar, save_path_calVar, save_path_idProcessed, chunksize=chunksize, workers=workers,
+        csv_engine=csv_engine
+    )
+else:
+    dfs = pipeline.run_pipeline(
+        base_path_maganamed, base_path_reference, df_redcapInfos, save_path_redcapIntegrated,
+        save_path_baseVar=save_path_baseVar if write_intermediate else None,
+        save_path_calVar=save_path_calVar if write_intermediate else None,
+        save_path_idProcessed=save_path_idProcessed if write_intermediate else None,
+        incremental=incremental,
+        output_format=output_format,
+        csv_engine=csv_engine
+    )
+
+if report:
+    run_report.finish_report(save_path_redcapIntegrated)
 
 
 
@@ -1,98 +1,394 @@
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
+import run_report
+from parallel import map_files
+from dtype_utils import convert_integer_floats, to_small_int
+from io_utils import (append_csv, append_csv_and_subset, check_chunked_format, list_csv_files, read_table,
+                      read_table_chunks, stored_bytes, write_table, write_table_and_subset)
 
-def merge_redcap_n_maganamed(df_redcapInfos, maganamed_folder_path, save_path):
+SPECIAL_FILES = ["Demographics-(Clinicians).csv", "cliniciansAnswer1.csv", "cliniciansAnswer3.csv"]
+
+# Columns left out of the condition-filtered files
+FILTERED_DROP_COLUMNS = ['condition', 'randomize']
+
+# Files being written in the background while the next file is merged; bounds the merged frames held in memory
+WRITE_WORKERS = 2
+MAX_PENDING_WRITES = 4
+
+
+def compact_redcap(df_redcapInfos):
     """
-    Adds 'unit', 'condition', and 'randomize' from REDCap info to all MaganaMed CSV files,
-    and saves both full merged and condition-filtered versions.
+    Returns the REDCap columns used for the integration with compact dtypes: 'study_id' as
+    categorical text, 'unit', 'condition' and 'randomize' as small nullable integers if they
+    are integer-like (categoricals otherwise).
+    """
+    df = df_redcapInfos[['study_id', 'unit', 'condition', 'randomize']].copy()
+    study_ids = df['study_id']
+    df['study_id'] = study_ids.where(study_ids.isna(), study_ids.astype(str)).astype('category')
+    for col in ['unit', 'condition', 'randomize']:
+        try:
+            df[col] = to_small_int(df[col])
+        except (TypeError, ValueError):
+            df[col] = df[col].astype('category')
+    return df
 
-    Args:
-        df_redcapInfos (pd.DataFrame): REDCap data containing 'record_id', 'unit', 'condition', 'randomize'.
-        maganamed_folder_path (str): Path to MaganaMed CSV files.
-        save_path (str): Output folder path to save merged and filtered files.
+
+REDCAP_COLUMNS = ['unit', 'condition', 'randomize']
+
+
+def build_redcap_index(df_redcapInfos):
     """
+    Indexes the REDCap allocation once by 'study_id' (see compact_redcap).
+    Duplicated study_ids are reported and only their first row is used.
+
+    Returns:
+        redcap_index (dict): 'ids' (pd.Index of the study_ids) and 'columns'
+            (allocation column -> array, aligned with 'ids').
+    """
+    df = compact_redcap(df_redcapInfos)
+    duplicated = df['study_id'].duplicated(keep='first') & df['study_id'].notna()
+    if duplicated.any():
+        duplicates = sorted(df.loc[duplicated, 'study_id'].astype(str).unique().tolist())
+        print(f"⚠️ Duplicated study_ids in the REDCap data, only their first row is used: {duplicates}")
+        df = df[~duplicated]
+    return {
+        'ids': pd.Index(df['study_id'].astype(object)),
+        'columns': {col: df[col].array for col in REDCAP_COLUMNS},
+    }
+
+
+def _redcap_positions(pids, ids):
+    # Row of every participant_identifier in the REDCap index (-1 if unmatched)
+    if isinstance(pids.dtype, pd.CategoricalDtype):
+        category_positions = ids.get_indexer(pids.cat.categories.astype(object))
+        codes = pids.cat.codes.to_numpy()
+        return np.where(codes >= 0, category_positions[codes], -1)
+    return ids.get_indexer(pids.astype(object))
+
+
+def attach_redcap(df_maganamed, csv_file, redcap_index):
+    """
+    Adds 'unit', 'condition', and 'randomize' from the REDCap index (see build_redcap_index)
+    to one MaganaMed DataFrame by a positional lookup of 'participant_identifier'.
+    The columns are inserted after 'center_name' (at the end if there is none); special clinician
+    files get 999. The input DataFrame is not modified.
+
+    Returns:
+        merged_df (pd.DataFrame): DataFrame with the REDCap columns.
+        unmatched (int): Number of rows without a REDCap unit.
+    """
+    # Drop unnecessary columns; the result only shares the data of df_maganamed
+    drop_cols = [col for col in ['record_id', 'study_id', *REDCAP_COLUMNS] if col in df_maganamed.columns]
+    merged_df = df_maganamed.drop(columns=drop_cols) if drop_cols else df_maganamed.copy(deep=False)
+
+    positions = _redcap_positions(df_maganamed['participant_identifier'], redcap_index['ids'])
+    values = {col: array.take(positions, allow_fill=True) for col, array in redcap_index['columns'].items()}
+    unmatched = int(pd.isna(values['unit']).sum())
+
+    # For special clinician files, set fixed value
+    if csv_file in SPECIAL_FILES:
+        values = {col: np.full(len(merged_df), 999) for col in REDCAP_COLUMNS}
+
+    # Insert new columns after 'center_name'
+    loc = merged_df.columns.get_loc('center_name') + 1 if 'center_name' in merged_df.columns else len(merged_df.columns)
+    for offset, col in enumerate(REDCAP_COLUMNS):
+        merged_df.insert(loc + offset, col, values[col])
+
+    # Convert float columns to Int64 to preserve NaN
+    merged_df = convert_integer_floats(merged_df)
+
+    return merged_df, unmatched
+
+
+def merge_redcap_into_df(df_maganamed, csv_file, df_redcapInfos):
+    """
+    Adds 'unit', 'condition', and 'randomize' from REDCap info to one MaganaMed DataFrame
+    and prints the number of unmatched rows. To integrate several files, build the index once
+    (build_redcap_index) and use attach_redcap.
+
+    Returns:
+        merged_df (pd.DataFrame): DataFrame with the REDCap columns after 'center_name'.
+    """
+    merged_df, unmatched = attach_redcap(df_maganamed, csv_file, build_redcap_index(df_redcapInfos))
+    print(f"Unmatched rows in {csv_file}: {unmatched}")
+    return merged_df
+
+
+def print_unmatched_summary(unmatched):
+    """
+    Prints the unmatched row counts of all files ({file: count}) as one summary.
+    """
+    total = sum(unmatched.values())
+    print(f"Unmatched rows (no REDCap unit): {total} in {sum(1 for n in unmatched.values() if n)} of {len(unmatched)} file(s)")
+    for csv_file, count in unmatched.items():
+        if count:
+            print(f"  {csv_file}: {count}")
+
+
+def condition_rows(merged_df):
+    """
+    Returns a boolean array of the rows of condition 1 or 999 (None if merged_df has no 'condition' column).
+    The filtered files are these rows without FILTERED_DROP_COLUMNS.
+    """
+    if 'condition' not in merged_df.columns:
+        return None
+    return merged_df['condition'].isin([1, 999]).to_numpy(dtype=bool)
+
+
+def filter_condition(merged_df):
+    """
+    Returns the rows of condition 1 or 999, without 'condition' and 'randomize'
+    (None if merged_df has no 'condition' column).
+    """
+    rows = condition_rows(merged_df)
+    if rows is None:
+        return None
+    return merged_df.loc[rows, [col for col in merged_df.columns if col not in FILTERED_DROP_COLUMNS]]
+
+
+def save_merged_and_filtered(merged_df, csv_file, output_folder_path, filtered_folder_path, output_format='csv'):
+    """
+    Saves the merged file and its condition-filtered version (condition 1 or 999)
+    in every format of output_format. Both files are written in one pass
+    (see io_utils.write_table_and_subset), without building the filtered DataFrame.
+    The writes are recorded as stage 'redcap_write' in the run report (they may run on the write pool).
+    """
+    with run_report.file_entry('redcap_write', csv_file) as entry:
+        #TODO: the filtered version is not needed anymore once we have the research database
+        rows = condition_rows(merged_df)
+        if rows is None:
+            write_table(merged_df, output_folder_path, csv_file, output_format)
+            print(f"✅ Saved merged: {os.path.join(output_folder_path, csv_file)}")
+            entry.update(rows_out=len(merged_df), bytes_written=stored_bytes(output_folder_path, csv_file, output_format))
+            return
+
+        write_table_and_subset(merged_df, output_folder_path, filtered_folder_path, csv_file, rows,
+                               FILTERED_DROP_COLUMNS, output_format)
+        print(f"✅ Saved merged: {os.path.join(output_folder_path, csv_file)}")
+        print(f"Filtered file saved: {os.path.join(filtered_folder_path, csv_file)}")
+        entry.update(rows_out=len(merged_df), filtered_rows=int(rows.sum()),
+                     bytes_written=stored_bytes(output_folder_path, csv_file, output_format)
+                     + stored_bytes(filtered_folder_path, csv_file, output_format))
+
+
+def _submit_write(executor, pending, *args):
+    """
+    Queues save_merged_and_filtered(*args) on the write pool. Waits for the oldest write first when
+    MAX_PENDING_WRITES are pending, so write errors surface early and memory stays bounded.
+    """
+    while len(pending) >= MAX_PENDING_WRITES:
+        pending.popleft().result()
+    pending.append(executor.submit(save_merged_and_filtered, *args))
+
+
+def _drain_writes(pending):
+    # Waits for all queued writes, re-raising the first error
+    while pending:
+        pending.popleft().result()
+
+
+def _merge_file_chunked(redcap_index, maganamed_folder_path, csv_file, output_folder_path, filtered_folder_path,
+                        input_format, chunksize):
+    """
+    Chunked variant of attach_redcap + save_merged_and_filtered for one file:
+    every chunk is merged, filtered and appended to both outputs.
+
+    Returns:
+        unmatched (int): Number of unmatched rows (None if the file was skipped).
+    """
+    unmatched, filtered = 0, False
+    n_rows, n_filtered = 0, 0
+    with run_report.file_entry('redcap_integration', csv_file) as entry:
+        for chunk_number, chunk in enumerate(read_table_chunks(maganamed_folder_path, csv_file, input_format, chunksize)):
+            first = chunk_number == 0
+            if first and chunk.empty:
+                print(f"Skipping {csv_file}: File is empty.")
+                return None
+            if 'participant_identifier' not in chunk.columns:
+                print(f"Skipping {csv_file}: No 'participant_identifier' column found.")
+                return None
+            merged_chunk, chunk_unmatched = attach_redcap(chunk, csv_file, redcap_index)
+            unmatched += chunk_unmatched
+            n_rows += len(merged_chunk)
+
+            rows = condition_rows(merged_chunk)
+            if rows is None:
+                append_csv(merged_chunk, output_folder_path, csv_file, first)
+            else:
+                append_csv_and_subset(merged_chunk, output_folder_path, filtered_folder_path, csv_file, rows,
+                                      FILTERED_DROP_COLUMNS, first)
+                filtered = True
+                n_filtered += int(rows.sum())
+
+        run_report.count('redcap_integration', 'unmatched_rows', unmatched)
+        entry.update(rows_in=n_rows, rows_out=n_rows, filtered_rows=n_filtered,
+                     bytes_read=stored_bytes(maganamed_folder_path, csv_file, input_format),
+                     bytes_written=stored_bytes(output_folder_path, csv_file) + stored_bytes(filtered_folder_path, csv_file))
+
+    print(f"✅ Saved merged: {os.path.join(output_folder_path, csv_file)}")
+    if filtered:
+        print(f"Filtered file saved: {os.path.join(filtered_folder_path, csv_file)}")
+    return unmatched
+
+
+def _prepare_output_folders(save_path):
     os.makedirs(save_path, exist_ok=True)
     output_folder_path = os.path.join(save_path, '01_integrated')
     filtered_folder_path = os.path.join(save_path, '02_filtered')
     os.makedirs(output_folder_path, exist_ok=True)
     os.makedirs(filtered_folder_path, exist_ok=True)
+    return output_folder_path, filtered_folder_path
 
-    csv_files = [f for f in os.listdir(maganamed_folder_path) if f.endswith('.csv')]
-    special_files = ["Demographics-(Clinicians).csv", "cliniciansAnswer1.csv", "cliniciansAnswer3.csv"]
 
-    for csv_file in csv_files:
-        file_path = os.path.join(maganamed_folder_path, csv_file)
+def _read_and_attach(csv_file, shared):
+    """
+    Reads one file of merge_redcap_n_maganamed and attaches the REDCap columns (shared: see there).
 
+    Returns:
+        (merged_df, unmatched), or None if the file was skipped.
+    """
+    maganamed_folder_path, input_format = shared['maganamed_folder_path'], shared['input_format']
+    file_path = os.path.join(maganamed_folder_path, csv_file)
+    with run_report.file_entry('redcap_integration', csv_file) as entry:
         try:
-            df_maganamed = pd.read_csv(file_path, sep=';')
+            df_maganamed = read_table(maganamed_folder_path, csv_file, input_format)
             if df_maganamed.empty:
                 print(f"Skipping {csv_file}: File is empty.")
-                continue
+                return None
         except Exception as e:
             print(f"❌ Error reading {file_path}: {e}")
-            continue
+            return None
+        entry.update(rows_in=len(df_maganamed), bytes_read=stored_bytes(maganamed_folder_path, csv_file, input_format))
 
         if 'participant_identifier' not in df_maganamed.columns:
             print(f"Skipping {csv_file}: No 'participant_identifier' column found.")
-            continue
-
-        merged_df = pd.merge(
-            df_maganamed,
-            df_redcapInfos[['study_id', 'unit', 'condition', 'randomize']],
-            left_on='participant_identifier',
-            right_on='study_id',
-            how='left'
-        )
-
-        unmatched_rows = merged_df[merged_df['unit'].isna()]
-        print(f"Unmatched rows in {csv_file}: {len(unmatched_rows)}")
-
-        # Drop unnecessary columns
-        merged_df.drop(columns=['record_id', 'study_id'], inplace=True, errors='ignore')
-
-        # Insert new columns after 'center_name'
-        if 'center_name' in merged_df.columns:
-            center_index = merged_df.columns.get_loc('center_name') + 1
-            cols = list(merged_df.columns)
-            if 'unit' in cols: cols.remove('unit')
-            if 'condition' in cols: cols.remove('condition')
-            if 'randomize' in cols: cols.remove('randomize')
-            cols.insert(center_index, 'unit')
-            cols.insert(center_index + 1, 'condition')
-            cols.insert(center_index + 2, 'randomize')
-
-            merged_df = merged_df[cols]
-
-        # For special clinician files, set fixed value
-        if csv_file in special_files:
-            for col in ['unit', 'condition', 'randomize']:
-                if col in merged_df.columns:
-                    merged_df[col] = 999
-
-        # Convert float columns to Int64 to preserve NaN
-        float_cols = merged_df.select_dtypes(include=['float']).columns
-        for col in float_cols:
-            merged_df[col] = pd.to_numeric(merged_df[col], errors='coerce')
-            if (merged_df[col].dropna() % 1 == 0).all():
-                merged_df[col] = merged_df[col].astype('Int64')
-            else:
-                # print(f" Skipped conversion to Int64 for '{col}' due to float values.")
+            return None
+
+        merged_df, unmatched = attach_redcap(df_maganamed, csv_file, shared['redcap_index'])
+        run_report.count('redcap_integration', 'unmatched_rows', unmatched)
+    return merged_df, unmatched
+
+
+def merge_file(csv_file, shared):
+    """
+    Merges and saves one file (in chunks with shared['chunksize']; shared: see merge_settings); runs in a
+    worker process in a parallel run. Returns the number of unmatched rows (None if the file was skipped).
+    """
+    if shared['chunksize']:
+        try:
+            return _merge_file_chunked(shared['redcap_index'], shared['maganamed_folder_path'], csv_file,
+                                       shared['output_folder_path'], shared['filtered_folder_path'],
+                                       shared['input_format'], shared['chunksize'])
+        except Exception as e:
+            print(f"❌ Error processing {os.path.join(shared['maganamed_folder_path'], csv_file)}: {e}")
+            return None
+
+    merged = _read_and_attach(csv_file, shared)
+    if merged is None:
+        return None
+    merged_df, unmatched = merged
+    save_merged_and_filtered(merged_df, csv_file, shared['output_folder_path'], shared['filtered_folder_path'],
+                             shared['output_format'])
+    return unmatched
+
+
+def merge_settings(df_redcapInfos, maganamed_folder_path, save_path, input_format='csv', output_format='csv',
+                   chunksize=None):
+    """
+    Creates the output folders and returns the settings shared by all files of merge_file
+    (arguments: see merge_redcap_n_maganamed).
+    """
+    output_folder_path, filtered_folder_path = _prepare_output_folders(save_path)
+    return {
+        'redcap_index': build_redcap_index(df_redcapInfos), 'maganamed_folder_path': maganamed_folder_path,
+        'output_folder_path': output_folder_path, 'filtered_folder_path': filtered_folder_path,
+        'input_format': input_format, 'output_format': output_format, 'chunksize': chunksize,
+    }
 
-        # Save merged file
-        output_file_path = os.path.join(output_folder_path, csv_file)
-        merged_df.to_csv(output_file_path, sep=';', index=False)
-        print(f"✅ Saved merged: {output_file_path}")
 
+def merge_redcap_n_maganamed(df_redcapInfos, maganamed_folder_path, save_path, input_format='csv', output_format='csv',
+                             chunksize=None, workers=None):
+    """
+    Adds 'unit', 'condition', and 'randomize' from REDCap info to all MaganaMed CSV files,
+    and saves both full merged and condition-filtered versions.
+
+    Args:
+        df_redcapInfos (pd.DataFrame): REDCap data containing 'record_id', 'unit', 'condition', 'randomize'.
+        maganamed_folder_path (str): Path to MaganaMed CSV files.
+        save_path (str): Output folder path to save merged and filtered files.
+        input_format (str): Format of the input files: 'csv', 'parquet' or 'feather'.
+        output_format (str or list): Format(s) of the output files, e.g. ['csv', 'parquet'].
+        chunksize (int, optional): Merge and filter the files in chunks of this many rows (CSV output only),
+            so memory use is bounded by the chunk size instead of the file size.
+        workers (int, optional): Process the files in a pool of this many processes (see parallel.map_files);
+            the REDCap index is sent once to every worker.
+    """
+    if chunksize:
+        check_chunked_format(output_format)
+
+    shared = merge_settings(df_redcapInfos, maganamed_folder_path, save_path, input_format, output_format, chunksize)
+    output_folder_path, filtered_folder_path = shared['output_folder_path'], shared['filtered_folder_path']
+
+    csv_files = list_csv_files(maganamed_folder_path, excluded_files=set(), input_format=input_format)
+
+    if chunksize or (workers and workers > 1):
+        results = map_files(merge_file, csv_files, shared, workers)
+        unmatched = {csv_file: n for csv_file, n in zip(csv_files, results) if n is not None}
+    else:
+        unmatched = {}
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+            for csv_file in csv_files:
+                merged = _read_and_attach(csv_file, shared)
+                if merged is None:
+                    continue
+                merged_df, unmatched[csv_file] = merged
+                # Written in the background while the next file is read and merged
+                _submit_write(executor, pending, merged_df, csv_file, output_folder_path, filtered_folder_path,
+                              output_format)
+            _drain_writes(pending)
+
+    print_unmatched_summary(unmatched)
+    print("✅ All files processed and saved successfully.")
 
 
-        # Save filtered version (condition 1 or 999) #TODO: no needs more if we have research database
-        if 'condition' in merged_df.columns:
-            # filtered_df = merged_df[merged_df['condition'] == 1]
-            filtered_df = merged_df[merged_df['condition'].isin([1, 999])]
-            filtered_df = filtered_df.drop(columns=['condition'])  # 'condition' drop
-            filtered_df = filtered_df.drop(columns=['randomize'])  # 'randomize' drop
-            filtered_output_path = os.path.join(filtered_folder_path, csv_file)
-            filtered_df.to_csv(filtered_output_path, sep=';', index=False)
-            print(f"Filtered file saved: {filtered_output_path}")
+def merge_redcap_n_maganamed_dfs(df_redcapInfos, dfs, save_path, output_format='csv'):
+    """
+    In-memory variant of merge_redcap_n_maganamed, taking the MaganaMed DataFrames directly.
+
+    Args:
+        df_redcapInfos (pd.DataFrame): REDCap data containing 'record_id', 'unit', 'condition', 'randomize'.
+        dfs (dict): File name -> MaganaMed DataFrame.
+        save_path (str): Output folder path to save merged and filtered files.
+        output_format (str or list): Format(s) of the output files, e.g. ['csv', 'parquet'].
+    """
+    output_folder_path, filtered_folder_path = _prepare_output_folders(save_path)
+    redcap_index = build_redcap_index(df_redcapInfos)
+    unmatched = {}
+
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+        for csv_file, df_maganamed in dfs.items():
+            if df_maganamed.empty:
+                print(f"Skipping {csv_file}: File is empty.")
+                continue
+
+            if 'participant_identifier' not in df_maganamed.columns:
+                print(f"Skipping {csv_file}: No 'participant_identifier' column found.")
+                continue
+
+            with run_report.file_entry('redcap_integration', csv_file) as entry:
+                entry['rows_in'] = len(df_maganamed)
+                merged_df, unmatched[csv_file] = attach_redcap(df_maganamed, csv_file, redcap_index)
+                run_report.count('redcap_integration', 'unmatched_rows', unmatched[csv_file])
+            # Written in the background while the next file is merged
+            _submit_write(executor, pending, merged_df, csv_file, output_folder_path, filtered_folder_path,
+                          output_format)
+        _drain_writes(pending)
 
+    print_unmatched_summary(unmatched)
     print("✅ All files processed and saved successfully.")
@@ -0,0 +1,61 @@
+from concurrent.futures import ProcessPoolExecutor
+import run_report
+
+# State shared by all tasks of a worker process, set once per worker (see worker_pool)
+_shared = None
+
+
+def _init_worker(shared, report, trace_memory):
+    global _shared
+    _shared = shared
+    # Forked workers inherit the report of the parent; record a fresh one (or none)
+    run_report.reset_report()
+    if report:
+        run_report.start_report(trace_memory=trace_memory)
+
+
+def _run_task(task, item):
+    return task(item, _shared), run_report.take_entries()
+
+
+def worker_pool(shared, workers):
+    """
+    Returns a pool of worker processes that each get shared (e.g. the site map or the REDCap index)
+    once instead of with every task. Submit tasks with submit_task and collect them with task_result.
+    """
+    initargs = (shared, run_report.is_active(), run_report.is_tracing_memory())
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs)
+
+
+def submit_task(executor, task, item):
+    """
+    Runs task(item, shared) in a worker of executor (see worker_pool); task must be a module-level function.
+    """
+    return executor.submit(_run_task, task, item)
+
+
+def task_result(future):
+    """
+    Returns the result of a task submitted with submit_task and merges the run report entries
+    recorded by the worker into the report of this process.
+    """
+    result, entries = future.result()
+    run_report.merge_entries(entries)
+    return result
+
+
+def map_files(task, items, shared, workers=None):
+    """
+    Calls task(item, shared) for every item and returns the results in item order.
+
+    With workers > 1 the tasks run in a pool of that many processes (see worker_pool); task must be
+    a module-level function. Run report entries recorded by the workers are merged into the report of
+    this process, so a parallel run reports (and, as the results keep their order, logs) the same as a serial one.
+    """
+    items = list(items)
+    if not workers or workers <= 1 or len(items) <= 1:
+        return [task(item, shared) for item in items]
+
+    with worker_pool(shared, min(workers, len(items))) as executor:
+        futures = [submit_task(executor, task, item) for item in items]
+        return [task_result(future) for future in futures]
@@ -0,0 +1,285 @@
+import os
+import base_variables
+import measure_calculation_woCopy
+import id_processing
+import merge_redcap_n_maganamed
+import run_manifest
+import run_report
+import scheduler
+from io_utils import file_version, list_csv_files, load_export, output_formats, save_dfs
+
+SITE_REFERENCE_FILE = 'Kind-of-participant.csv'
+
+
+def run_pipeline(base_path_maganamed, base_path_reference, df_redcapInfos, save_path_redcapIntegrated,
+                 save_path_baseVar=None, save_path_calVar=None, save_path_idProcessed=None, incremental=False,
+                 output_format='csv', csv_engine=None):
+    """
+    Runs all processing stages in memory: every export file is read once and only
+    the final REDCap-integrated outputs are written.
+
+    Intermediate results are only written if their save path is given (for debugging).
+    Stage logs are written to the stage's save path, or to save_path_redcapIntegrated otherwise.
+
+    With incremental=True, a run manifest (_run_manifest.json in save_path_redcapIntegrated) records
+    a content hash of every export file and of the shared inputs (Kind-of-participant.csv, the
+    reference Excel file, the REDCap data and the code). Files unchanged since the last run keep
+    their previous outputs and are not even read. The manifest also records the log entries of every file,
+    so the stage logs still cover all files: the entries of the unchanged files are taken from it.
+
+    Args:
+        base_path_maganamed (str): Path to the MaganaMed export (folder or ZIP file).
+        base_path_reference (str): Path to the ID processing reference Excel file.
+        df_redcapInfos (pd.DataFrame): REDCap data containing 'study_id', 'unit', 'condition', 'randomize'.
+        save_path_redcapIntegrated (str): Output folder for merged and filtered files.
+        save_path_baseVar (str, optional): Output folder for files with base variables.
+        save_path_calVar (str, optional): Output folder for files with calculated values.
+        save_path_idProcessed (str, optional): Output folder for ID processed files.
+        incremental (bool): Skip export files whose inputs are unchanged since the last run.
+        output_format (str or list): Format(s) of all written files: 'csv', 'parquet' and/or 'feather'.
+        csv_engine (str, optional): 'pyarrow' to parse the export files with the multi-threaded pyarrow reader.
+
+    Returns:
+        dfs (dict): ID processed DataFrames (before REDCap integration) of the processed files.
+    """
+    os.makedirs(save_path_redcapIntegrated, exist_ok=True)
+
+    file_names = list_csv_files(base_path_maganamed)
+    if SITE_REFERENCE_FILE not in file_names:
+        print(f"❌ Reference file '{SITE_REFERENCE_FILE}' not found.")
+        return None
+
+    unchanged, previous_manifest = set(), None
+    if incremental:
+        with run_report.stage('manifest'):
+            manifest_path = os.path.join(save_path_redcapIntegrated, run_manifest.MANIFEST_FILE)
+            previous_manifest = run_manifest.load_manifest(manifest_path)
+            inputs = run_manifest.shared_inputs(
+                os.path.join(base_path_maganamed, SITE_REFERENCE_FILE),
+                os.path.join(base_path_reference, id_processing.REFERENCE_FILE), df_redcapInfos,
+                settings={'output_format': list(output_formats(output_format))}
+            )
+            file_hashes = {f: run_manifest.file_hash(os.path.join(base_path_maganamed, f)) for f in file_names}
+            unchanged = run_manifest.unchanged_files(previous_manifest, inputs, file_hashes, save_path_redcapIntegrated)
+        print(f"🔁 Incremental run: {len(file_names) - len(unchanged)} file(s) to process, {len(unchanged)} unchanged")
+        if len(unchanged) == len(file_names):
+            print("✅ Nothing changed since the last run.")
+            return {}
+
+    # (0) load the export once (the site reference is always needed)
+    to_load = [f for f in file_names if f not in unchanged or f == SITE_REFERENCE_FILE]
+    with run_report.stage('load_export'):
+        dfs = load_export(base_path_maganamed, file_names=to_load, engine=csv_engine)
+    if SITE_REFERENCE_FILE not in dfs:
+        return None
+    reference_map = base_variables.build_site_map(dfs[SITE_REFERENCE_FILE])
+    if reference_map is None:
+        return None
+    if SITE_REFERENCE_FILE in unchanged:
+        del dfs[SITE_REFERENCE_FILE]
+    processed = set(dfs)
+    # Log entries per stage and file, in file order (those of unchanged files from the manifest)
+    file_logs = {stage: run_manifest.previous_logs(previous_manifest, file_names, unchanged, stage)
+                 for stage in ('base_variables', 'id_processing')}
+
+    # (1) add base variables (SiteCode, VisitCode)
+    log_path = save_path_baseVar or save_path_redcapIntegrated
+    with run_report.stage('base_variables'):
+        dfs = base_variables.add_base_variables_to_dfs(dfs, reference_map, log_path, file_logs['base_variables'])
+    if save_path_baseVar:
+        with run_report.stage('save_baseVar'):
+            save_dfs(dfs, save_path_baseVar, output_format, report_stage='save_baseVar')
+
+    # (2) add calculated values
+    with run_report.stage('calculated_values'):
+        dfs = measure_calculation_woCopy.calculate_dfs(dfs)
+    if save_path_calVar:
+        with run_report.stage('save_calVar'):
+            save_dfs(dfs, save_path_calVar, output_format, report_stage='save_calVar')
+
+    # (3) perform the id processing
+    with run_report.stage('id_processing'):
+        df_ref = id_processing.load_reference_excel(base_path_reference)
+        plan = id_processing.compile_id_plan(df_ref)
+        dfs, delete_log, exchange_log, merge_log, conflict_report = id_processing.run_id_processing(
+            df_ref, dfs, plan, file_logs['id_processing'])
+        id_log_path = save_path_idProcessed or save_path_redcapIntegrated
+        id_processing.save_id_processing_logs(delete_log, exchange_log, merge_log, id_log_path, conflict_report)
+        id_processing.save_id_plan(plan, id_log_path)
+    if save_path_idProcessed:
+        with run_report.stage('save_idProcessed'):
+            save_dfs(dfs, save_path_idProcessed, output_format, report_stage='save_idProcessed')
+
+    # (4) Integrate REDCap and filtering
+    with run_report.stage('redcap_integration'):
+        merge_redcap_n_maganamed.merge_redcap_n_maganamed_dfs(df_redcapInfos, dfs, save_path_redcapIntegrated,
+                                                              output_format)
+
+    if incremental:
+        with run_report.stage('manifest'):
+            logs = {f: {stage: file_logs[stage][f] for stage in file_logs} for f in processed}
+            manifest = run_manifest.build_manifest(inputs, file_hashes, save_path_redcapIntegrated, processed,
+                                                   previous_manifest, logs)
+            run_manifest.save_manifest(manifest, manifest_path)
+
+    return dfs
+
+
+def run_pipeline_streaming(base_path_maganamed, base_path_reference, df_redcapInfos, save_path_redcapIntegrated,
+                           save_path_baseVar, save_path_calVar, save_path_idProcessed, chunksize=100_000, workers=None,
+                           csv_engine=None):
+    """
+    Bounded-memory variant of run_pipeline for very large exports: the row-local stages
+    (base variables, calculated values, REDCap integration and filtering) process every file
+    in chunks of chunksize rows and append to their outputs; ID processing keeps only one file in memory.
+    The stages pass their results on through the intermediate folders, which are therefore required.
+    Only CSV output is supported. With workers, base variables, calculated values and the REDCap
+    integration process their files in a pool of that many processes (see parallel.map_files);
+    the outputs and logs are the same as in a serial run.
+
+    Args:
+        base_path_maganamed (str): Path to the MaganaMed export (folder or ZIP file).
+        base_path_reference (str): Path to the ID processing reference Excel file.
+        df_redcapInfos (pd.DataFrame): REDCap data containing 'study_id', 'unit', 'condition', 'randomize'.
+        save_path_redcapIntegrated (str): Output folder for merged and filtered files.
+        save_path_baseVar (str): Output folder for files with base variables.
+        save_path_calVar (str): Output folder for files with calculated values.
+        save_path_idProcessed (str): Output folder for ID processed files.
+        chunksize (int): Rows per chunk (None: whole files).
+        workers (int, optional): Number of worker processes for the per-file stages.
+        csv_engine (str, optional): 'pyarrow' to parse the files of ID processing with the pyarrow reader.
+    """
+    # (1) add base variables (SiteCode, VisitCode)
+    with run_report.stage('base_variables'):
+        base_variables.add_base_variables(base_path_maganamed, save_path_baseVar, chunksize=chunksize, workers=workers)
+
+    # (2) add calculated values
+    with run_report.stage('calculated_values'):
+        measure_calculation_woCopy.calculate_and_save(save_path_baseVar, save_path_calVar, chunksize=chunksize,
+                                                      workers=workers)
+        measure_calculation_woCopy.copy_unprocessed_files(save_path_baseVar, save_path_calVar)
+
+    # (3) perform the id processing
+    with run_report.stage('id_processing'):
+        id_processing.run_id_processing_and_save(base_path_reference, save_path_calVar, save_path_idProcessed,
+                                                 one_file_at_a_time=True, csv_engine=csv_engine)
+
+    # (4) Integrate REDCap and filtering
+    with run_report.stage('redcap_integration'):
+        merge_redcap_n_maganamed.merge_redcap_n_maganamed(df_redcapInfos, save_path_idProcessed,
+                                                          save_path_redcapIntegrated, chunksize=chunksize,
+                                                          workers=workers)
+
+
+def _base_variables_task(file_name, shared):
+    return base_variables.enrich_file(file_name, shared['base_variables'])
+
+
+def _calculated_values_task(file_name, shared):
+    return measure_calculation_woCopy.calculate_file(file_name, shared['calculated_values'])
+
+
+def _redcap_integration_task(file_name, shared):
+    settings = shared['redcap_integration']
+    if not os.path.exists(os.path.join(settings['maganamed_folder_path'], file_name)):
+        return None  # Not passed on by the earlier stages (e.g. no 'participant_identifier')
+    return merge_redcap_n_maganamed.merge_file(file_name, settings)
+
+
+def run_pipeline_scheduled(base_path_maganamed, base_path_reference, df_redcapInfos, save_path_redcapIntegrated,
+                           save_path_baseVar, save_path_calVar, save_path_idProcessed, chunksize=None, workers=None,
+                           checkpoint=True, csv_engine=None):
+    """
+    Variant of run_pipeline_streaming that runs the pipeline as (stage, file) tasks with their dependencies
+    (see scheduler.run_tasks). Base variables and calculated values only depend on the same file, so with
+    workers a file is scored while others are still being enriched; ID processing is the only stage that waits
+    for all files, the REDCap integration of every file then only waits for it.
+
+    With checkpoint, every finished task is recorded in save_path_redcapIntegrated/_run_checkpoint.json,
+    and a run interrupted (or failed) in any stage resumes with the unfinished tasks when it is started again
+    with the same inputs (export files, reference files, REDCap data, code and chunksize). The intermediate
+    folders must be kept until then. Outputs and logs are the same as those of run_pipeline_streaming.
+
+    Args:
+        base_path_maganamed (str): Path to the MaganaMed export (folder or ZIP file).
+        base_path_reference (str): Path to the ID processing reference Excel file.
+        df_redcapInfos (pd.DataFrame): REDCap data containing 'study_id', 'unit', 'condition', 'randomize'.
+        save_path_redcapIntegrated (str): Output folder for merged and filtered files.
+        save_path_baseVar (str): Output folder for files with base variables.
+        save_path_calVar (str): Output folder for files with calculated values.
+        save_path_idProcessed (str): Output folder for ID processed files.
+        chunksize (int, optional): Rows per chunk of the file-local stages (None: whole files).
+        workers (int, optional): Number of worker processes for the file-local stages.
+        checkpoint (bool): Record finished tasks and resume an interrupted run.
+        csv_engine (str, optional): 'pyarrow' to parse the files of ID processing with the pyarrow reader.
+    """
+    reference_map = base_variables.load_site_map(base_path_maganamed)
+    if reference_map is None:
+        return
+    file_names = list_csv_files(base_path_maganamed)
+    for folder in (save_path_baseVar, save_path_calVar, save_path_idProcessed):
+        os.makedirs(folder, exist_ok=True)
+
+    shared = {
+        'base_variables': {
+            'base_path': base_path_maganamed, 'save_path': save_path_baseVar, 'input_format': 'csv',
+            'output_format': 'csv', 'chunksize': chunksize, 'reference_map': reference_map,
+        },
+        'calculated_values': {
+            'base_path': save_path_baseVar, 'save_path': save_path_calVar, 'input_format': 'csv',
+            'output_format': 'csv', 'chunksize': chunksize,
+        },
+        'redcap_integration': merge_redcap_n_maganamed.merge_settings(
+            df_redcapInfos, save_path_idProcessed, save_path_redcapIntegrated, chunksize=chunksize),
+    }
+
+    def save_base_variable_logs(results):
+        base_variables.save_base_variable_logs([results[f"base_variables/{f}"] for f in file_names], save_path_baseVar)
+        # The logs are passed on like the files without calculated values
+        for log_file in os.listdir(save_path_baseVar):
+            if log_file.startswith('_'):
+                measure_calculation_woCopy.copy_unprocessed_file(save_path_baseVar, save_path_calVar, log_file)
+        print(f"--- ✅✅✅ Base variable processing completed! All outputs have been saved to: {save_path_baseVar} ------------")
+
+    def run_id_processing(results):
+        print(f"--- ✅✅✅ Calculated Values processing completed! All outputs have been saved to: {save_path_calVar} ------------")
+        with run_report.stage('id_processing'):
+            id_processing.run_id_processing_and_save(base_path_reference, save_path_calVar, save_path_idProcessed,
+                                                     one_file_at_a_time=True, csv_engine=csv_engine)
+
+    def print_unmatched_summary(results):
+        results = [(f, results[f"redcap_integration/{f}"]) for f in file_names]
+        merge_redcap_n_maganamed.print_unmatched_summary({f: n for f, n in results if n is not None})
+        print("✅ All files processed and saved successfully.")
+
+    # (1)-(2) base variables and calculated values, file by file
+    tasks = []
+    for f in file_names:
+        tasks.append(scheduler.task(f"base_variables/{f}", _base_variables_task, f))
+        tasks.append(scheduler.task(f"calculated_values/{f}", _calculated_values_task, f, after=[f"base_variables/{f}"]))
+    tasks.append(scheduler.task("base_variables_logs", save_base_variable_logs, local=True,
+                                after=[f"base_variables/{f}" for f in file_names]))
+    # (3) ID processing, once all files have their calculated values
+    tasks.append(scheduler.task("id_processing", run_id_processing, local=True,
+                                after=["base_variables_logs"] + [f"calculated_values/{f}" for f in file_names]))
+    # (4) REDCap integration and filtering, file by file
+    tasks += [scheduler.task(f"redcap_integration/{f}", _redcap_integration_task, f, after=["id_processing"])
+              for f in file_names]
+    tasks.append(scheduler.task("redcap_summary", print_unmatched_summary, local=True,
+                                after=[f"redcap_integration/{f}" for f in file_names]))
+
+    checkpoint_path, run_key = None, None
+    if checkpoint:
+        checkpoint_path = os.path.join(save_path_redcapIntegrated, scheduler.CHECKPOINT_FILE)
+        run_key = {
+            'inputs': run_manifest.shared_inputs(
+                os.path.join(base_path_maganamed, SITE_REFERENCE_FILE),
+                os.path.join(base_path_reference, id_processing.REFERENCE_FILE), df_redcapInfos,
+                settings={'chunksize': chunksize}
+            ),
+            # Size and modification time (or CRC) of the export files, cheaper than hashing them
+            'files': {f: file_version(base_path_maganamed, f) for f in file_names},
+        }
+
+    with run_report.stage('scheduled_pipeline'):
+        scheduler.run_tasks(tasks, shared, workers, checkpoint_path, run_key)
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import pandas as pd
+from io_utils import FILE_FORMATS, open_file
+
+MANIFEST_FILE = "_run_manifest.json"
+
+# Modules whose source defines the outputs; a change in any of them invalidates the manifest
+PIPELINE_MODULES = [
+    "base_variables.py", "measure_calculation_woCopy.py", "scoring.py", "dtype_utils.py",
+    "id_processing.py", "merge_redcap_n_maganamed.py", "io_utils.py", "pipeline.py", "run_manifest.py",
+]
+
+
+def file_hash(file_path, chunk_size=1 << 20):
+    """
+    Returns the SHA-256 hex digest of the content of file_path (which may be in an archive, see io_utils.open_file).
+    """
+    digest = hashlib.sha256()
+    with open_file(file_path) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def df_hash(df):
+    """
+    Returns a SHA-256 hex digest of the content (values, index and column names) of df.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(col) for col in df.columns]).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def code_version(module_dir=os.path.dirname(os.path.abspath(__file__))):
+    """
+    Returns one SHA-256 hex digest over the source of all PIPELINE_MODULES.
+    """
+    digest = hashlib.sha256()
+    for module in PIPELINE_MODULES:
+        module_path = os.path.join(module_dir, module)
+        digest.update(module.encode("utf-8"))
+        if os.path.exists(module_path):
+            digest.update(file_hash(module_path).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def shared_inputs(site_reference_path, id_reference_path, df_redcapInfos, settings=None):
+    """
+    Hashes of the inputs every output depends on.
+
+    Args:
+        site_reference_path (str): Path to 'Kind-of-participant.csv'.
+        id_reference_path (str): Path to the ID processing reference Excel file.
+        df_redcapInfos (pd.DataFrame): REDCap data used for the integration.
+        settings (dict, optional): Settings that change the outputs (JSON serializable).
+
+    Returns:
+        inputs (dict): Input name -> hash.
+    """
+    return {
+        "code": code_version(),
+        "settings": hashlib.sha256(json.dumps(settings or {}, sort_keys=True).encode("utf-8")).hexdigest(),
+        "Kind-of-participant.csv": file_hash(site_reference_path),
+        "id_reference": file_hash(id_reference_path),
+        "redcap": df_hash(df_redcapInfos),
+    }
+
+
+def load_manifest(manifest_path):
+    """
+    Reads the manifest of the previous run, or returns None if there is none (or it cannot be read).
+    """
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable run manifest {manifest_path}: {e}")
+        return None
+
+
+def _to_json(value):
+    # Log values of the stages: Series and arrays as lists, DataFrames as column -> values, NumPy scalars as numbers
+    if isinstance(value, pd.DataFrame):
+        return value.to_dict("list")
+    if value is pd.NA:
+        return None
+    return value.tolist() if hasattr(value, "tolist") else str(value)
+
+
+def save_manifest(manifest, manifest_path):
+    """
+    Writes the manifest as JSON (to a temporary file first, so an interrupted run never leaves half a manifest).
+    Keys keep their order, as the column order of the logs depends on it.
+    """
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, default=_to_json)
+    os.replace(tmp_path, manifest_path)
+
+
+def unchanged_files(manifest, inputs, file_hashes, output_root):
+    """
+    Returns the files that need no reprocessing: the shared inputs are the same as in the
+    previous run, the file content is the same and all of its previous outputs still exist.
+
+    Args:
+        manifest (dict): Manifest of the previous run (or None).
+        inputs (dict): Current shared input hashes, see shared_inputs.
+        file_hashes (dict): File name -> current content hash.
+        output_root (str): Folder the output paths in the manifest are relative to.
+
+    Returns:
+        unchanged (set): File names whose previous outputs can be reused.
+    """
+    if not manifest or manifest.get("inputs") != inputs:
+        return set()
+
+    unchanged = set()
+    for file_name, file_hash_ in file_hashes.items():
+        entry = manifest.get("files", {}).get(file_name)
+        if entry is None or entry.get("hash") != file_hash_ or "logs" not in entry:
+            continue
+        if all(os.path.exists(os.path.join(output_root, path)) for path in entry.get("outputs", [])):
+            unchanged.add(file_name)
+    return unchanged
+
+
+def build_manifest(inputs, file_hashes, output_root, processed_files, previous=None, logs=None):
+    """
+    Builds the manifest of this run: processed files get their current outputs (paths below
+    output_root named like the file, in any of the FILE_FORMATS) and their log entries (logs:
+    file name -> stage -> entries), unchanged files keep their entry of the previous run.
+    Files no longer in the export and files that could not be processed are left out.
+    """
+    outputs = {}
+    for folder, _, names in os.walk(output_root):
+        for name in names:
+            stem, extension = os.path.splitext(name)
+            if extension in FILE_FORMATS.values():
+                outputs.setdefault(stem + ".csv", []).append(os.path.relpath(os.path.join(folder, name), output_root))
+
+    files = {}
+    for file_name, file_hash_ in file_hashes.items():
+        if file_name in processed_files:
+            files[file_name] = {"hash": file_hash_, "outputs": sorted(outputs.get(file_name, [])),
+                                "logs": (logs or {}).get(file_name, {})}
+        elif previous and previous.get("files", {}).get(file_name, {}).get("hash") == file_hash_:
+            files[file_name] = previous["files"][file_name]
+    return {"inputs": inputs, "files": files}
+
+
+def previous_logs(manifest, file_names, unchanged, stage):
+    """
+    Returns file name -> log entries of stage for all file_names, in their order: the entries recorded
+    in the manifest for the unchanged files, None for the others (see build_manifest).
+    """
+    files = (manifest or {}).get("files", {})
+    return {f: files[f]["logs"].get(stage) if f in unchanged else None for f in file_names}
@@ -0,0 +1,257 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPORT_FILE = "_run_report.json"
+
+# Report of the current run (None: instrumentation is off and all functions below do nothing)
+_report = None
+_lock = threading.Lock()
+
+
+def start_report(trace_memory=False, profile_stages=(), settings=None):
+    """
+    Starts recording a run report: wall time, rows, bytes and memory per stage and per (stage, file),
+    and counters (see count). Stages and files are recorded by the stage and file_entry context managers.
+
+    Args:
+        trace_memory (bool): Record the peak Python memory (tracemalloc) of every stage and file.
+            Slows the run down; otherwise only the process' peak resident memory so far is recorded.
+        profile_stages (list or True): Stages to run under cProfile (True: all); the statistics are
+            saved next to the report as '_profile_<stage>.prof' (see pstats).
+        settings (dict, optional): Settings of the run, stored in the report (JSON serializable).
+    """
+    global _report
+    if trace_memory:
+        tracemalloc.start()
+    _report = {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "settings": settings or {},
+        "trace_memory": trace_memory,
+        "profile_stages": profile_stages,
+        "stages": {},
+        "files": {},
+        "counters": {},
+        "profiles": {},
+        "_open_peaks": [],
+    }
+
+
+def finish_report(save_path):
+    """
+    Stops recording and writes the report as JSON to save_path/_run_report.json
+    (and the cProfile statistics of the profiled stages next to it).
+
+    Returns:
+        report (dict): The report (None if no report was started).
+    """
+    global _report
+    report, _report = _report, None
+    if report is None:
+        return None
+    if report["trace_memory"]:
+        tracemalloc.stop()
+
+    os.makedirs(save_path, exist_ok=True)
+    for name, profile in report["profiles"].items():
+        profile_file = f"_profile_{name}.prof"
+        profile.dump_stats(os.path.join(save_path, profile_file))
+        report["profiles"][name] = profile_file
+
+    report = {
+        "started": report["started"],
+        "finished": datetime.now().isoformat(timespec="seconds"),
+        "settings": report["settings"],
+        "stages": report["stages"],
+        "files": list(report["files"].values()),
+        "counters": report["counters"],
+        "profiles": report["profiles"],
+    }
+    report_path = os.path.join(save_path, REPORT_FILE)
+    with open(report_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=_to_json)
+    os.replace(report_path + ".tmp", report_path)
+    print(f"📊 Run report saved to: {os.path.abspath(report_path)}")
+    return report
+
+
+def _to_json(value):
+    # numpy integers and floats
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+def _max_rss_mb():
+    # Peak resident memory of the process so far (kilobytes on Linux, bytes on macOS)
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(max_rss / (1e6 if sys.platform == "darwin" else 1e3), 1)
+
+
+def _memory_fields(report, peaks):
+    if report["trace_memory"]:
+        peak = max([tracemalloc.get_traced_memory()[1], *peaks])
+        return {"peak_mb": round(peak / 1e6, 1)}, peak
+    return {"max_rss_mb": _max_rss_mb()}, 0
+
+
+def _add(entry, fields):
+    # Accumulates seconds and numbers, keeps the maximum of the memory fields
+    for key, value in fields.items():
+        if value is None:
+            continue
+        if key in ("peak_mb", "max_rss_mb"):
+            entry[key] = max(entry.get(key) or 0, value)
+        elif key == "seconds":
+            entry[key] = round(entry.get(key, 0) + value, 4)
+        else:
+            entry[key] = value
+
+
+@contextmanager
+def stage(name):
+    """
+    Records the wall time and memory of a pipeline stage (accumulated if the stage runs several times),
+    and profiles it if requested (see start_report).
+    """
+    report = _report
+    if report is None:
+        yield
+        return
+
+    profile_stages = report["profile_stages"]
+    profile = None
+    if profile_stages is True or name in profile_stages:
+        profile = report["profiles"].setdefault(name, cProfile.Profile())
+    peaks = []
+    report["_open_peaks"].append(peaks)
+    if report["trace_memory"]:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    if profile:
+        profile.enable()
+    try:
+        yield
+    finally:
+        if profile:
+            profile.disable()
+        seconds = time.perf_counter() - start
+        report["_open_peaks"].pop()
+        memory, peak = _memory_fields(report, peaks)
+        if report["_open_peaks"]:
+            report["_open_peaks"][-1].append(peak)
+        _add(report["stages"].setdefault(name, {}), {"seconds": seconds, **memory})
+
+
+@contextmanager
+def file_entry(stage_name, file_name):
+    """
+    Records one (stage, file) pair: yields a dict to which the caller adds 'rows_in', 'rows_out',
+    'bytes_read' and 'bytes_written'; wall time and memory are added on exit. Entering the same
+    pair again (e.g. once for reading and once for processing) adds to the same entry.
+    """
+    report = _report
+    if report is None:
+        yield {}
+        return
+
+    fields = {}
+    if report["trace_memory"] and threading.current_thread() is threading.main_thread():
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        fields["seconds"] = time.perf_counter() - start
+        if threading.current_thread() is threading.main_thread():
+            memory, peak = _memory_fields(report, [])
+            fields.update(memory)
+            if report["_open_peaks"]:
+                report["_open_peaks"][-1].append(peak)
+        _record(report, stage_name, file_name, fields)
+
+
+def _record(report, stage_name, file_name, fields):
+    with _lock:
+        entry = report["files"].setdefault((stage_name, file_name), {"stage": stage_name, "file": file_name})
+        _add(entry, fields)
+
+
+def record(stage_name, file_name, **fields):
+    """
+    Adds fields (e.g. bytes_written=...) to the (stage, file) entry without timing anything,
+    for work that is timed by an enclosing file_entry of the same pair.
+    """
+    report = _report
+    if report is not None:
+        _record(report, stage_name, file_name, fields)
+
+
+def count(stage_name, name, value=1):
+    """
+    Adds value to the counter name of stage_name (e.g. missing SiteCodes, unmatched REDCap rows).
+    """
+    report = _report
+    if report is None:
+        return
+    with _lock:
+        counters = report["counters"].setdefault(stage_name, {})
+        counters[name] = counters.get(name, 0) + int(value)
+
+
+def is_active():
+    return _report is not None
+
+
+def is_tracing_memory():
+    return _report is not None and _report["trace_memory"]
+
+
+def reset_report():
+    """
+    Stops recording without writing a report.
+    """
+    global _report
+    if _report is not None and _report["trace_memory"]:
+        tracemalloc.stop()
+    _report = None
+
+
+def take_entries():
+    """
+    Returns the file entries and counters recorded so far and clears them
+    (used by worker processes, see merge_entries). Returns None if no report is recorded.
+    """
+    report = _report
+    if report is None:
+        return None
+    with _lock:
+        entries = {"files": list(report["files"].values()), "counters": report["counters"]}
+        report["files"], report["counters"] = {}, {}
+    return entries
+
+
+def merge_entries(entries):
+    """
+    Adds file entries and counters taken from another process (see take_entries) to the current report.
+    """
+    report = _report
+    if report is None or not entries:
+        return
+    for entry in entries["files"]:
+        fields = {key: value for key, value in entry.items() if key not in ("stage", "file")}
+        _record(report, entry["stage"], entry["file"], fields)
+    for stage_name, counters in entries["counters"].items():
+        for name, value in counters.items():
+            count(stage_name, name, value)
@@ -0,0 +1,121 @@
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, wait
+import parallel
+
+CHECKPOINT_FILE = "_run_checkpoint.json"
+
+
+def task(name, function, item=None, after=(), local=False):
+    """
+    Returns one task of run_tasks. It runs once all tasks named in after are done:
+    as function(item, shared), in a worker process if run_tasks has workers, or, if local,
+    in this process as function(results), with the name -> result of all tasks done so far
+    (e.g. to write the logs of a stage).
+    """
+    return {'name': name, 'function': function, 'item': item, 'after': list(after), 'local': local}
+
+
+def _to_json(value):
+    # pd.Series (e.g. unmatched participant_identifiers) and numpy numbers
+    return value.tolist() if hasattr(value, 'tolist') else str(value)
+
+
+def load_checkpoint(checkpoint_path, run_key):
+    """
+    Returns the results of the tasks done by an interrupted run with the same run_key
+    ({} if there is no such checkpoint).
+    """
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return {}
+    try:
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable checkpoint {checkpoint_path}: {e}")
+        return {}
+    if checkpoint.get('run_key') != json.loads(json.dumps(run_key)):
+        print("⚠️ Inputs changed since the interrupted run, its checkpoint is ignored.")
+        return {}
+    return checkpoint.get('done', {})
+
+
+def save_checkpoint(checkpoint_path, run_key, results):
+    """
+    Writes the results of the tasks done so far as JSON (to a temporary file first,
+    so an interrupted run never leaves half a checkpoint).
+    """
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({'run_key': run_key, 'done': results}, f, default=_to_json)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def run_tasks(tasks, shared, workers=None, checkpoint_path=None, run_key=None):
+    """
+    Runs tasks (see task) in dependency order and returns their results (task name -> result).
+
+    Of the tasks whose dependencies are done, the first in task order runs next. With workers > 1,
+    up to that many run at the same time in a pool of worker processes that get shared once
+    (see parallel.worker_pool); as the next stage of a file is listed before the first stage of the
+    following files, files are pipelined: one file is already in its next stage while others are
+    still in the first. Local tasks run in this process as soon as they are ready.
+
+    With checkpoint_path, the result of every finished task is saved there, and tasks saved by an
+    interrupted run with the same run_key (e.g. the hashes of the inputs) are not run again.
+    The checkpoint is removed when all tasks are done.
+    """
+    names = {t['name'] for t in tasks}
+    results = {name: result for name, result in load_checkpoint(checkpoint_path, run_key).items() if name in names}
+    if results:
+        print(f"🔁 Resuming from checkpoint: {len(results)} of {len(tasks)} tasks already done")
+    todo = [t for t in tasks if t['name'] not in results]
+
+    def finish(t, result):
+        results[t['name']] = result
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, run_key, results)
+
+    def ready():
+        return [t for t in todo if all(name in results for name in t['after'])]
+
+    def blocked():
+        return ValueError(f"Tasks with unknown or circular dependencies: {[t['name'] for t in todo]}")
+
+    if not workers or workers <= 1:
+        while todo:
+            next_tasks = ready()
+            if not next_tasks:
+                raise blocked()
+            t = next_tasks[0]
+            todo.remove(t)
+            finish(t, t['function'](results) if t['local'] else t['function'](t['item'], shared))
+    else:
+        with parallel.worker_pool(shared, workers) as executor:
+            running = {}
+            try:
+                while todo or running:
+                    next_tasks = ready()
+                    local = next((t for t in next_tasks if t['local']), None)
+                    if local:
+                        todo.remove(local)
+                        finish(local, local['function'](results))
+                        continue
+                    for t in next_tasks[:workers - len(running)]:
+                        todo.remove(t)
+                        running[parallel.submit_task(executor, t['function'], t['item'])] = t
+                    if not running:
+                        raise blocked()
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(running.pop(future), parallel.task_result(future))
+            except BaseException:
+                # Keep the results of the tasks that were still running for the next run
+                for future, t in running.items():
+                    if not future.cancel() and future.exception() is None:
+                        finish(t, parallel.task_result(future))
+                raise
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return results
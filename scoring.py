@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+
+def coerce_items(df, item_cols):
+    """
+    Converts the item columns to one float block (rows x items), non-numeric values becoming NaN.
+    Only columns that are not numeric yet go through pd.to_numeric.
+    """
+    frame = df[item_cols]
+    text_cols = [col for col in item_cols if not pd.api.types.is_numeric_dtype(frame[col])]
+    if text_cols:
+        frame = frame.copy()
+        frame[text_cols] = frame[text_cols].apply(pd.to_numeric, errors='coerce')
+    return frame.to_numpy(dtype='float64', na_value=np.nan)
+
+
+def to_int_array(values):
+    """
+    Converts a float vector to an Int64 array, NaN becoming <NA>.
+    Raises TypeError for non-integer values, like astype('Int64').
+    """
+    nan_mask = np.isnan(values)
+    with np.errstate(invalid='ignore'):
+        integer_like = np.isfinite(values) & (values == np.trunc(values))
+    if not (integer_like | nan_mask).all():
+        raise TypeError("cannot safely cast non-equivalent float64 to int64")
+    return pd.arrays.IntegerArray(np.where(nan_mask, 0, values).astype('int64'), nan_mask)
+
+
+def recode(block, mapping):
+    """
+    Recodes an integer-valued float block with a lookup array built from mapping ({old: new}).
+    Values not in mapping and missing values become NaN.
+    """
+    keys = np.array(list(mapping.keys()), dtype='int64')
+    offset = keys.min()
+    table = np.full(keys.max() - offset + 1, np.nan)
+    table[keys - offset] = list(mapping.values())
+
+    with np.errstate(invalid='ignore'):
+        in_range = (block >= offset) & (block <= keys.max())
+    positions = np.where(in_range, block - offset, 0).astype('int64')
+    return np.where(in_range, table[positions], np.nan)
+
+
+def join_flag_labels(df, flags, other=None, separator=', '):
+    """
+    Builds a label column from multi-select (checkbox) flags: for every row, the labels of all
+    flags equal to 1 and the value of the free-text 'other' column (if present and not missing),
+    joined with separator.
+
+    Args:
+        df (pd.DataFrame): Form data.
+        flags (dict): Flag column -> label, in output order.
+        other (str, optional): Free-text column appended after the flags.
+        separator (str): Separator between labels.
+
+    Returns:
+        labels (pd.Series): Joined labels ('' if nothing is selected).
+    """
+    labels = pd.Series('', index=df.index, dtype=object)
+    for col, label in flags.items():
+        selected = (df[col] == 1).fillna(False).to_numpy(dtype=bool)
+        labels = labels + np.where(selected, separator + label, '')
+
+    if other is not None and other in df.columns:
+        values = df[other]
+        labels = labels + np.where(values.notna(), separator + values.astype(str), '')
+
+    return labels.str.slice(len(separator))
+
+
+def _weight_matrix(columns, default_items, scores):
+    """
+    Returns a (columns x scores) 0/1 matrix: column j selects the items of score j.
+    """
+    col_index = {col: i for i, col in enumerate(columns)}
+    weights = np.zeros((len(columns), len(scores)))
+    for j, score in enumerate(scores):
+        for col in score.get('items', default_items):
+            weights[col_index[col], j] = 1
+    return weights
+
+
+def score_instrument(df, spec):
+    """
+    Scores one questionnaire according to its spec (see INSTRUMENT_SPECS in measure_calculation_woCopy):
+
+    - 'items': columns converted to Int64 (non-numeric values become <NA>)
+    - 'reverse_items' / 'scale_max': items scored as (scale_max + 1 - value); the item columns themselves are kept
+    - 'recodes': list of {'items', 'names', 'values' ({old: new})}: adds the recoded items as Int64
+      columns 'names' (values not in 'values' become <NA>); scores can use them like items
+    - 'scores': list of {'name', 'items' (default: all items), 'method' ('sum' or 'mean'), 'divisor', 'round'}
+    - 'copies': {new column: source column}, copied unchanged
+    - 'flag_labels': list of {'name', 'flags' ({flag column: label}), 'other', 'separator'}, see join_flag_labels
+    - 'numeric_to_int': if True, all float64/int64 columns are converted to Int64 at the end
+
+    The items are coerced once, recoded with lookup arrays and all scores are computed with a single matrix product.
+    Sums skip missing items (all missing -> 0), means are taken over the answered items.
+    """
+    items = spec.get('items', [])
+    scores = spec.get('scores', [])
+
+    if items:
+        block = coerce_items(df, items)
+        for i, col in enumerate(items):
+            df[col] = to_int_array(block[:, i])
+
+        columns = list(items)
+        recoded_blocks = []
+        for rec in spec.get('recodes', []):
+            recoded = recode(block[:, [items.index(col) for col in rec['items']]], rec['values'])
+            for i, col in enumerate(rec['names']):
+                df[col] = to_int_array(recoded[:, i])
+            columns.extend(rec['names'])
+            recoded_blocks.append(recoded)
+
+        if scores:
+            scoring_block = np.hstack([block] + recoded_blocks)
+            reverse_idx = [items.index(col) for col in spec.get('reverse_items', [])]
+            if reverse_idx:
+                scoring_block[:, reverse_idx] = spec['scale_max'] + 1 - scoring_block[:, reverse_idx]
+
+            answered = ~np.isnan(scoring_block)
+            weights = _weight_matrix(columns, items, scores)
+            sums = np.where(answered, scoring_block, 0) @ weights
+            counts = answered.astype('float64') @ weights
+
+            for j, score in enumerate(scores):
+                values = sums[:, j]
+                if score.get('method', 'sum') == 'mean':
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        values = np.where(counts[:, j] > 0, values / counts[:, j], np.nan)
+                if 'divisor' in score:
+                    values = values / score['divisor']
+                if 'round' in score:
+                    values = np.round(values, score['round'])
+
+                if score.get('method', 'sum') == 'sum' and 'divisor' not in score:
+                    df[score['name']] = to_int_array(values)
+                else:
+                    df[score['name']] = values
+
+    for new_col, source_col in spec.get('copies', {}).items():
+        df[new_col] = df[source_col]
+
+    for flag_label in spec.get('flag_labels', []):
+        df[flag_label['name']] = join_flag_labels(
+            df, flag_label['flags'], flag_label.get('other'), flag_label.get('separator', ', ')
+        )
+
+    if spec.get('numeric_to_int'):
+        numeric_columns = df.select_dtypes(include=['float64', 'int64']).columns
+        df[numeric_columns] = df[numeric_columns].astype('Int64')
+
+    return df
@@ -0,0 +1,46 @@
+import contextlib
+import filecmp
+import io
+import os
+import sys
+import warnings
+import pandas as pd
+from pandas.errors import SettingWithCopyWarning
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_PATH)
+sys.path.insert(0, os.path.join(REPO_PATH, "benchmarks"))
+import pipeline
+from synthetic_export import generate_export
+
+
+def _run(paths, save_path, incremental):
+    df_redcapInfos = pd.read_csv(paths['redcap'], sep=';')
+    with warnings.catch_warnings(record=True) as caught, contextlib.redirect_stdout(io.StringIO()):
+        warnings.simplefilter("always")
+        pipeline.run_pipeline(paths['export'], paths['reference'], df_redcapInfos, save_path, incremental=incremental)
+    assert not [w for w in caught if issubclass(w.category, SettingWithCopyWarning)]
+
+
+def _log_files(save_path):
+    return sorted(name for name in os.listdir(save_path) if name.startswith('_') and not name.startswith('_run_'))
+
+
+def test_incremental_run_keeps_logs_of_unchanged_files(tmp_path):
+    paths = generate_export(str(tmp_path / "data"), n_participants=200)
+    incremental_path, full_path = str(tmp_path / "incremental"), str(tmp_path / "full")
+    _run(paths, incremental_path, incremental=True)
+
+    # Change one form, then rerun incrementally: only that file is reprocessed
+    form_path = os.path.join(paths['export'], 'Unscored-Form.csv')
+    df = pd.read_csv(form_path, sep=';')
+    df.iloc[:-5].to_csv(form_path, sep=';', index=False)
+    _run(paths, incremental_path, incremental=True)
+    _run(paths, full_path, incremental=False)
+
+    log_files = _log_files(full_path)
+    assert {'_sitecode_log.txt', '_visitcode_log.txt', '_delete_log.csv', '_merge_log.csv',
+            '_merge_conflicts.csv'} <= set(log_files)
+    assert _log_files(incremental_path) == log_files
+    for name in log_files:
+        assert filecmp.cmp(os.path.join(full_path, name), os.path.join(incremental_path, name), shallow=False), name